@@ -0,0 +1,251 @@
+import argparse
+import json
+import math
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+from mock_mail_server import MockMailServer, parse_folders
+from proton_scraping import ProtonMailScraper, RunMetrics
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Report keys compared against a baseline, and whether higher is better
+COMPARED_METRICS = {
+    'messages_per_sec': True,
+    'wall_time': False,
+    'peak_python_mb': False,
+}
+
+
+class SampledMetrics(RunMetrics):
+    """RunMetrics that also keeps every stage duration, for percentiles"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.samples = {}
+
+    def observe(self, stage, seconds, error=None, **labels):
+        super().observe(stage, seconds, error, **labels)
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+
+class BenchmarkScraper(ProtonMailScraper):
+    """ProtonMailScraper whose metrics keep the duration of every stage"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = SampledMetrics(self.metrics.log_path, self.metrics.trace_path)
+
+    @property
+    def saved(self):
+        """Messages on disk; counted by the scraper only once a save succeeded"""
+        return sum(value for (name, _), value in self.metrics.counters.items() if name == 'messages_saved')
+
+
+class BrowserMemorySampler:
+    """Poll the resident memory of this process and its browser children"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if psutil is None:
+            return self
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        me = psutil.Process()
+        while not self._stop.wait(self.interval):
+            total = 0
+            for proc in [me] + me.children(recursive=True):
+                try:
+                    total += proc.memory_info().rss
+                except psutil.Error:
+                    pass
+            self.peak = max(self.peak, total)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def stage_summary(times):
+    return {
+        'count': len(times),
+        'total': round(sum(times), 4),
+        'p50': round(percentile(times, 50), 4),
+        'p95': round(percentile(times, 95), 4),
+        'max': round(max(times), 4) if times else 0.0,
+    }
+
+
+def run_benchmark(args):
+    server = MockMailServer(
+        folders=parse_folders(args.folders),
+        latency=args.latency,
+        attachment_every=args.attachment_every,
+        attachments_per_message=args.attachments_per_message,
+        attachment_size=args.attachment_size,
+        inline_images=args.inline_images,
+        page_size=args.page_size,
+        layout=args.layout,
+        virtualize=args.virtualize,
+        error_rate=args.error_rate
+    ).start()
+
+    with tempfile.TemporaryDirectory(prefix="proton_bench_") as base_dir:
+        scraper = BenchmarkScraper(
+            base_dir=base_dir,
+            days_back=args.days_back,
+            headless=not args.headed,
+            log_waits=args.verbose,
+            open_mode=args.open_mode,
+            storage=args.storage,
+            compression=args.compression,
+            folder_workers=args.folder_workers,
+            search_index=not args.no_search_index,
+            login_url=server.login_url,
+            mail_url=server.mail_url
+        )
+
+        sampler = BrowserMemorySampler().start()
+        tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            with scraper.browser_manager() as manager:
+                scraper.scrape_account("bench@example.com", "bench", manager=manager)
+        finally:
+            wall_time = time.perf_counter() - started
+            _, peak_python = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            sampler.stop()
+            server.stop()
+
+        disk_bytes = sum(f.stat().st_size for f in Path(base_dir).rglob('*') if f.is_file())
+
+    expected = server.total_messages(args.days_back)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_rss_mb = max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'config': vars(args),
+        'messages_expected': expected,
+        'messages_saved': scraper.saved,
+        'wall_time': round(wall_time, 3),
+        'messages_per_sec': round(scraper.saved / wall_time, 3) if wall_time else 0.0,
+        'peak_python_mb': round(peak_python / (1024 * 1024), 2),
+        'max_rss_mb': round(max_rss_mb, 2),
+        'peak_browser_tree_mb': round(sampler.peak / (1024 * 1024), 2) if psutil else None,
+        'archive_mb': round(disk_bytes / (1024 * 1024), 2),
+        'mock_requests': server.requests,
+        'stages': {stage: stage_summary(times) for stage, times in scraper.metrics.samples.items()},
+        'waits': scraper.wait_stats,
+        'counters': scraper.metrics.snapshot()['counters'],
+        'retry_list': sum(len(entries) for folders in scraper.load_retry_list().values() for entries in folders.values()),
+    }
+
+
+def print_report(report):
+    print(f"\n{'='*60}")
+    print(f"Saved {report['messages_saved']}/{report['messages_expected']} messages "
+          f"in {report['wall_time']:.1f}s ({report['messages_per_sec']:.2f} msg/s)")
+    print(f"Peak Python heap: {report['peak_python_mb']:.1f} MB, max RSS: {report['max_rss_mb']:.1f} MB", end="")
+    if report['peak_browser_tree_mb'] is not None:
+        print(f", with browser: {report['peak_browser_tree_mb']:.1f} MB")
+    else:
+        print()
+    print(f"Archive size: {report['archive_mb']:.2f} MB, mock requests: {report['mock_requests']}")
+    print(f"{'='*60}")
+    print(f"\n{'Stage':<22}{'Count':>8}{'Total (s)':>11}{'p50 (s)':>10}{'p95 (s)':>10}{'Max (s)':>10}")
+    for stage, stats in report['stages'].items():
+        if stats['count']:
+            print(f"{stage:<22}{stats['count']:>8}{stats['total']:>11.2f}{stats['p50']:>10.3f}"
+                  f"{stats['p95']:>10.3f}{stats['max']:>10.3f}")
+
+
+def compare_to_baseline(report, baseline, tolerance):
+    """Return the metrics that regressed by more than tolerance (a fraction)"""
+    regressions = []
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        old, new = baseline.get(metric), report.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{metric}: {old} -> {new} ({change:+.1%})")
+    if report['messages_saved'] < baseline.get('messages_saved', 0):
+        regressions.append(f"messages_saved: {baseline['messages_saved']} -> {report['messages_saved']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scraper against a local mock mail app")
+    parser.add_argument('--folders', default='Inbox=100,Sent=30,Archive=50', help='Folder sizes, e.g. "Inbox=200,Sent=50,Work=20"')
+    parser.add_argument('--days-back', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds added to every mock API call')
+    parser.add_argument('--attachment-every', type=int, default=10, help='Every Nth message has attachments (0 = none)')
+    parser.add_argument('--attachments-per-message', type=int, default=1)
+    parser.add_argument('--attachment-size', type=int, default=20000, help='Attachment size in bytes')
+    parser.add_argument('--inline-images', type=int, default=0, help='Data-URI images per message body')
+    parser.add_argument('--page-size', type=int, default=50, help='Rows loaded per list scroll')
+    parser.add_argument('--layout', choices=('column', 'row'), default='column')
+    parser.add_argument('--virtualize', type=int, default=0, help='Keep at most N list rows in the DOM (0 = keep all)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of message/attachment requests that fail')
+    parser.add_argument('--open-mode', choices=('auto', 'pane', 'back'), default='auto')
+    parser.add_argument('--storage', choices=('eml', 'cas', 'mbox', 'maildir'), default='eml')
+    parser.add_argument('--compression', choices=('gzip', 'zstd'))
+    parser.add_argument('--folder-workers', type=int, default=1)
+    parser.add_argument('--no-search-index', action='store_true')
+    parser.add_argument('--headed', action='store_true', help='Show the browser window')
+    parser.add_argument('--verbose', action='store_true', help='Log every wait')
+    parser.add_argument('--output', default='benchmark_results.json', help='Where to write the JSON report')
+    parser.add_argument('--baseline', help='Earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed regression as a fraction (default: 0.15)')
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_report(report)
+
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"\nReport written to {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print("\n❌ Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n✓ No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+
+from proton_scraping import ProtonMailScraper, SqliteWorkQueue
+
+
+def load_accounts(path):
+    """Read a JSON list of {"email": ..., "password": ...} objects"""
+    return json.loads(Path(path).read_text())
+
+
+def print_status(work_queue):
+    status = work_queue.status()
+    now = time.time()
+    print(f"\n[{datetime.now()}] Queue status")
+    for kind, states in sorted(status['units'].items()):
+        counts = ", ".join(f"{state}: {n}" for state, n in sorted(states.items()))
+        print(f"  {kind:<8} {counts}")
+    for worker in status['workers']:
+        if worker['state'] == 'active':
+            print(f"  worker {worker['id']}: {worker['units_done']} units done, seen {now - worker['last_seen']:.0f}s ago")
+    for unit in status['failed']:
+        print(f"  ❌ {unit['kind']} {unit['account']} {unit['folder']}: {unit['error']} ({unit['attempts']} attempts)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spread accounts over several scraper workers through a shared queue")
+    parser.add_argument('--queue', default='protonmail_queue.db', help='Queue database, on a volume every worker can reach')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help='Queue the accounts of a run')
+    enqueue.add_argument('accounts', help='JSON file with the accounts')
+    enqueue.add_argument('--requeue', action='store_true', help='Queue finished accounts again (e.g. for a daily run)')
+    enqueue.add_argument('--watch', action='store_true', help='Keep printing the status until the queue is drained')
+
+    worker = commands.add_parser('worker', help='Claim and scrape units until the queue is drained')
+    worker.add_argument('accounts', help='JSON file with the credentials this worker may use')
+    worker.add_argument('--base-dir', default='protonmail_data', help="This worker's archive and state, on a local disk")
+    worker.add_argument('--days-back', type=int, default=30)
+    worker.add_argument('--worker-id', help='Defaults to <hostname>-<pid>')
+    worker.add_argument('--lease', type=int, default=300, help='Lease length in seconds (renewed every third of it)')
+    worker.add_argument('--headless', action='store_true')
+    worker.add_argument('--reuse-sessions', action='store_true')
+    worker.add_argument('--incremental', action='store_true')
+    worker.add_argument('--storage', choices=('eml', 'cas', 'mbox', 'maildir'), default='eml')
+
+    status = commands.add_parser('status', help='Show progress, workers and failed units')
+    status.add_argument('--watch', action='store_true', help='Refresh until the queue is drained')
+
+    args = parser.parse_args()
+    work_queue = SqliteWorkQueue(args.queue)
+
+    if args.command == 'enqueue':
+        accounts = load_accounts(args.accounts)
+        work_queue.add_accounts([account['email'] for account in accounts], requeue=args.requeue)
+        print(f"Queued {len(accounts)} accounts in {args.queue}")
+
+    elif args.command == 'worker':
+        scraper = ProtonMailScraper(
+            base_dir=args.base_dir,
+            days_back=args.days_back,
+            headless=args.headless,
+            reuse_sessions=args.reuse_sessions,
+            incremental=args.incremental,
+            storage=args.storage
+        )
+        scraper.run_worker(load_accounts(args.accounts), work_queue, worker_id=args.worker_id, lease_seconds=args.lease)
+
+    if args.command in ('enqueue', 'status'):
+        print_status(work_queue)
+        while args.watch and not work_queue.drained():
+            time.sleep(10)
+            print_status(work_queue)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Folders the scraper knows by their navigation-link test id; anything else becomes a label
+SYSTEM_FOLDERS = ('Inbox', 'Sent', 'Drafts', 'Starred', 'Archive', 'Spam', 'Trash')
+
+# A 1x1 transparent GIF, used for remote images and tracking pixels
+PIXEL_GIF = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+    b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+
+# A small PNG, embedded as a data URI to mimic inline images in message bodies
+INLINE_PNG_B64 = (
+    'iVBORw0KGgoAAAANSUhEUgAAABAAAAAQCAYAAAAf8/9hAAAAKklEQVR4nGNgYGD4z0AEYBxVSFcF'
+    'DAwM/xmIAIyjCkcVjiocVTiqkH4KAfC2Af8O1TpHAAAAAElFTkSuQmCC'
+)
+
+LOGIN_HTML = """<!DOCTYPE html>
+<html>
+<head><title>Mock Mail - Sign in</title></head>
+<body>
+<form id="login">
+    <input name="username" type="text" placeholder="Email">
+    <input name="password" type="password" placeholder="Password">
+    <button type="submit">Sign in</button>
+</form>
+<script>
+document.getElementById('login').addEventListener('submit', (event) => {
+    event.preventDefault();
+    document.cookie = 'mock_session=1; path=/';
+    setTimeout(() => { location.href = '/u/0/inbox'; }, __LOGIN_DELAY_MS__);
+});
+</script>
+</body>
+</html>
+"""
+
+APP_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<title>Mock Mail</title>
+<style>
+    body { margin: 0; font-family: sans-serif; display: flex; height: 100vh; }
+    #nav { width: 180px; display: flex; flex-direction: column; padding: 8px; }
+    #main { flex: 1; display: flex; min-width: 0; }
+    #list { width: 420px; overflow-y: auto; border-right: 1px solid #ccc; }
+    #pane { flex: 1; overflow-y: auto; padding: 8px; }
+    .item { display: flex; flex-direction: column; padding: 8px; border-bottom: 1px solid #eee; cursor: pointer; }
+    #sentinel { height: 1px; }
+</style>
+</head>
+<body>
+<div id="nav"></div>
+<div id="main"></div>
+<script>
+const LAYOUT = '__LAYOUT__';
+const VIRTUALIZE = __VIRTUALIZE__;
+const PAGE_SIZE = __PAGE_SIZE__;
+
+const state = { folder: null, offset: 0, done: false, loading: false };
+let observer = null;
+
+async function api(path) {
+    const response = await fetch(path);
+    if (!response.ok) {
+        throw new Error(`${path}: HTTP ${response.status}`);
+    }
+    return response.json();
+}
+
+function el(tag, attrs, text) {
+    const node = document.createElement(tag);
+    for (const [name, value] of Object.entries(attrs || {})) {
+        node.setAttribute(name, value);
+    }
+    if (text !== undefined) {
+        node.textContent = text;
+    }
+    return node;
+}
+
+function renderListShell() {
+    const main = document.getElementById('main');
+    main.innerHTML = '';
+    const list = el('div', { id: 'list' });
+    list.appendChild(el('div', { id: 'sentinel' }));
+    main.appendChild(list);
+    if (LAYOUT === 'column') {
+        main.appendChild(el('div', { id: 'pane' }));
+    }
+    if (observer) {
+        observer.disconnect();
+    }
+    observer = new IntersectionObserver((entries) => {
+        if (entries.some((entry) => entry.isIntersecting)) {
+            loadMore();
+        }
+    }, { root: list });
+    observer.observe(document.getElementById('sentinel'));
+}
+
+async function openFolder(key, push) {
+    state.folder = key;
+    state.offset = 0;
+    state.done = false;
+    state.loading = false;
+    if (push !== false) {
+        history.pushState({}, '', '/u/0/' + key);
+    }
+    renderListShell();
+    await loadMore();
+}
+
+async function loadMore() {
+    if (state.loading || state.done) {
+        return;
+    }
+    const key = state.folder;
+    state.loading = true;
+    const rows = await api(`/api/messages?folder=${encodeURIComponent(key)}&offset=${state.offset}&limit=${PAGE_SIZE}`);
+    if (state.folder !== key) {
+        return;
+    }
+    const list = document.getElementById('list');
+    const sentinel = document.getElementById('sentinel');
+    if (!list) {
+        state.loading = false;
+        return;
+    }
+    for (const message of rows) {
+        const row = el('div', { 'class': 'item', 'data-testid': 'message-item', 'data-element-id': message.id });
+        row.appendChild(el('span', { 'data-testid': 'message-row:sender' }, message.from));
+        row.appendChild(el('span', { 'data-testid': 'message-row:subject' }, message.subject));
+        row.appendChild(el('time', { datetime: message.iso }, message.list_date));
+        row.addEventListener('click', () => openMessage(key, message.id, true));
+        list.insertBefore(row, sentinel);
+    }
+    if (VIRTUALIZE > 0) {
+        const items = list.querySelectorAll('[data-testid="message-item"]');
+        for (let i = 0; i < items.length - VIRTUALIZE; i++) {
+            items[i].remove();
+        }
+    }
+    state.offset += rows.length;
+    state.done = rows.length < PAGE_SIZE;
+    state.loading = false;
+}
+
+async function openMessage(key, id, push) {
+    if (push) {
+        history.pushState({}, '', '/u/0/' + key + '/' + id);
+    }
+    const message = await api(`/api/message?folder=${encodeURIComponent(key)}&id=${encodeURIComponent(id)}`);
+    let pane = document.getElementById('pane');
+    if (LAYOUT !== 'column') {
+        const main = document.getElementById('main');
+        main.innerHTML = '';
+        pane = el('div', { id: 'pane' });
+        main.appendChild(pane);
+    }
+    pane.innerHTML = '';
+    pane.appendChild(el('h1', { 'data-testid': 'message-header-subject' }, message.subject));
+    const header = el('div');
+    header.appendChild(el('span', { 'data-testid': 'message-header-from' }, message.from));
+    header.appendChild(document.createTextNode(' '));
+    header.appendChild(el('span', { 'data-testid': 'message-header-date' }, message.date));
+    pane.appendChild(header);
+    const content = el('div', { 'data-testid': 'message-content' });
+    content.innerHTML = message.body_html;
+    pane.appendChild(content);
+    message.attachments.forEach((attachment, n) => {
+        const box = el('div', { 'data-testid': 'attachment-' + n });
+        box.appendChild(el('span', {}, attachment.name));
+        const button = el('button', { title: 'Download', 'aria-label': 'Download' });
+        button.addEventListener('click', () => {
+            const link = el('a', { href: attachment.url, download: attachment.name });
+            document.body.appendChild(link);
+            link.click();
+            link.remove();
+        });
+        box.appendChild(button);
+        pane.appendChild(box);
+    });
+}
+
+window.addEventListener('popstate', () => {
+    const parts = location.pathname.split('/');
+    if (parts[4]) {
+        openMessage(parts[3], parts[4], false);
+    } else {
+        openFolder(parts[3] || 'inbox', false);
+    }
+});
+
+async function init() {
+    const folders = await api('/api/folders');
+    const nav = document.getElementById('nav');
+    for (const folder of folders) {
+        const link = el('a', { href: '#', 'data-testid': 'navigation-link:' + folder.key }, folder.name);
+        link.addEventListener('click', (event) => {
+            event.preventDefault();
+            openFolder(folder.key, true);
+        });
+        nav.appendChild(link);
+    }
+    const parts = location.pathname.split('/');
+    await openFolder(parts[3] || 'inbox', false);
+    if (parts[4]) {
+        openMessage(parts[3], parts[4], false);
+    }
+}
+
+init();
+</script>
+</body>
+</html>
+"""
+
+
+class MockMailServer:
+    """Local stand-in for the ProtonMail web app
+
+    Serves a small single-page app with the same data-testid selectors the
+    scraper relies on (login form, navigation links, message-item rows,
+    message header/content, attachment download buttons), backed by
+    generated mailboxes. Folder sizes, API latency, attachments, list page
+    size, layout, list virtualization and an injected error rate are
+    configurable so scraper throughput can be measured offline.
+    """
+
+    def __init__(self, folders=None, latency=0.0, login_delay=0.2, attachment_every=10,
+                 attachments_per_message=1, attachment_size=20000, inline_images=0,
+                 page_size=50, layout='column', virtualize=0, messages_per_day=20,
+                 error_rate=0.0, host='127.0.0.1', port=0):
+        self.folders = folders or {'Inbox': 100, 'Sent': 30, 'Archive': 50}
+        self.latency = latency
+        self.login_delay = login_delay
+        self.attachment_every = attachment_every
+        self.attachments_per_message = attachments_per_message
+        self.attachment_size = attachment_size
+        self.inline_images = inline_images
+        self.page_size = page_size
+        self.layout = layout
+        self.virtualize = virtualize
+        self.messages_per_day = messages_per_day
+        # Fraction of message and attachment requests answered with a 503
+        self.error_rate = error_rate
+        self.host = host
+        self.port = port
+        self.now = datetime.now().replace(second=0, microsecond=0)
+        self.requests = 0
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def login_url(self):
+        return self.url + "/login"
+
+    @property
+    def mail_url(self):
+        return self.url + "/u/0/inbox"
+
+    def start(self):
+        """Serve in a background thread; returns self"""
+        handler = type('MockMailHandler', (_MockMailHandler,), {'mock': self})
+        self._httpd = ThreadingHTTPServer((self.host, self.port), handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-mail", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def folder_list(self):
+        result = []
+        for name in self.folders:
+            if name in SYSTEM_FOLDERS:
+                result.append({'key': name.lower(), 'name': name})
+            else:
+                result.append({'key': 'label-' + self._slug(name), 'name': name})
+        return result
+
+    def folder_name(self, key):
+        for folder in self.folder_list():
+            if folder['key'] == key:
+                return folder['name']
+        return None
+
+    def total_messages(self, days_back=None):
+        """Number of generated messages, optionally only those within days_back"""
+        total = 0
+        for name, count in self.folders.items():
+            if days_back is None:
+                total += count
+            else:
+                total += sum(1 for i in range(count) if self._date(i) >= self.now - timedelta(days=days_back))
+        return total
+
+    def message_row(self, folder, i):
+        sent = self._date(i)
+        if sent.date() == self.now.date():
+            list_date = sent.strftime('%H:%M')
+        else:
+            list_date = sent.strftime('%b %d').replace(' 0', ' ')
+        return {
+            'id': self._id(folder, i),
+            'subject': f"{folder} message {i}: quarterly report #{i % 97}",
+            'from': f"Sender {i % 13} <sender{i % 13}@example.com>",
+            'iso': sent.isoformat(),
+            'list_date': list_date,
+        }
+
+    def message(self, folder, i):
+        row = self.message_row(folder, i)
+        sent = self._date(i)
+        paragraphs = "".join(
+            f"<p>Paragraph {p} of message {i} in {folder}. Lorem ipsum dolor sit amet, "
+            f"consectetur adipiscing elit, sed do eiusmod tempor incididunt.</p>"
+            for p in range(5)
+        )
+        images = "".join(
+            f'<img alt="inline {n}" src="data:image/png;base64,{INLINE_PNG_B64}">'
+            for n in range(self.inline_images)
+        )
+        body_html = (
+            f'<div>{paragraphs}{images}'
+            f'<img alt="avatar" src="/pixel.gif?m={row["id"]}">'
+            f'<img alt="" width="1" height="1" src="http://tracker.invalid/open.gif?m={row["id"]}"></div>'
+        )
+        attachments = []
+        if self.attachment_every and i % self.attachment_every == 0:
+            for n in range(self.attachments_per_message):
+                attachments.append({
+                    'name': f"report_{i}_{n}.pdf",
+                    'url': f"/api/attachment?folder={self._key(folder)}&id={row['id']}&n={n}",
+                })
+        return {
+            'id': row['id'],
+            'subject': row['subject'],
+            'from': row['from'],
+            'date': sent.strftime('%a, %b %d, %Y %I:%M %p'),
+            'body_html': body_html,
+            'attachments': attachments,
+        }
+
+    def attachment(self, folder, message_id, n):
+        seed = hashlib.sha256(f"{folder}:{message_id}:{n}".encode()).digest()
+        data = (seed * (self.attachment_size // len(seed) + 1))[:self.attachment_size]
+        return b"%PDF-1.4\n" + data
+
+    def index_of(self, folder, message_id):
+        for i in range(self.folders.get(folder, 0)):
+            if self._id(folder, i) == message_id:
+                return i
+        return None
+
+    def _date(self, i):
+        return self.now - timedelta(hours=i * 24 / self.messages_per_day)
+
+    def _id(self, folder, i):
+        return hashlib.sha1(f"{folder}:{i}".encode()).hexdigest()[:24]
+
+    def _key(self, folder):
+        return folder.lower() if folder in SYSTEM_FOLDERS else 'label-' + self._slug(folder)
+
+    @staticmethod
+    def _slug(name):
+        return "".join(c.lower() if c.isalnum() else '-' for c in name)
+
+
+class _MockMailHandler(BaseHTTPRequestHandler):
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.mock.requests += 1
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path == '/login':
+            html = LOGIN_HTML.replace('__LOGIN_DELAY_MS__', str(int(self.mock.login_delay * 1000)))
+            return self._send(200, html.encode(), 'text/html; charset=utf-8')
+
+        if url.path.startswith('/u/0/'):
+            if 'mock_session=1' not in self.headers.get('Cookie', ''):
+                return self._redirect('/login')
+            html = (APP_HTML
+                    .replace('__LAYOUT__', self.mock.layout)
+                    .replace('__VIRTUALIZE__', str(int(self.mock.virtualize)))
+                    .replace('__PAGE_SIZE__', str(int(self.mock.page_size))))
+            return self._send(200, html.encode(), 'text/html; charset=utf-8')
+
+        if url.path == '/pixel.gif':
+            return self._send(200, PIXEL_GIF, 'image/gif')
+
+        if url.path == '/api/folders':
+            return self._json(self.mock.folder_list())
+
+        if url.path.startswith('/api/'):
+            time.sleep(self.mock.latency)
+            if url.path in ('/api/message', '/api/attachment') and random.random() < self.mock.error_rate:
+                return self._json({'error': 'try again later'}, 503)
+            folder = self.mock.folder_name(query.get('folder', ''))
+            if folder is None:
+                return self._json({'error': 'unknown folder'}, 404)
+
+            if url.path == '/api/messages':
+                offset = int(query.get('offset', 0))
+                limit = int(query.get('limit', self.mock.page_size))
+                end = min(offset + limit, self.mock.folders[folder])
+                return self._json([self.mock.message_row(folder, i) for i in range(offset, end)])
+
+            i = self.mock.index_of(folder, query.get('id', ''))
+            if i is None:
+                return self._json({'error': 'unknown message'}, 404)
+
+            if url.path == '/api/message':
+                return self._json(self.mock.message(folder, i))
+
+            if url.path == '/api/attachment':
+                n = int(query.get('n', 0))
+                name = f"report_{i}_{n}.pdf"
+                return self._send(200, self.mock.attachment(folder, query['id'], n), 'application/pdf',
+                                  {'Content-Disposition': f'attachment; filename="{name}"'})
+
+        self._send(404, b'not found', 'text/plain')
+
+    def _json(self, data, status=200):
+        self._send(status, json.dumps(data).encode(), 'application/json')
+
+    def _redirect(self, location):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def parse_folders(spec):
+    """Parse "Inbox=200,Sent=50,Work=20" into a folder -> message count dict"""
+    folders = {}
+    for item in spec.split(','):
+        name, _, count = item.partition('=')
+        folders[name.strip()] = int(count or 0)
+    return folders
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local mock of the ProtonMail web app")
+    parser.add_argument('--folders', default='Inbox=100,Sent=30,Archive=50', help='Folder sizes, e.g. "Inbox=200,Sent=50,Work=20"')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every API call')
+    parser.add_argument('--attachment-every', type=int, default=10, help='Every Nth message has attachments (0 = none)')
+    parser.add_argument('--attachments-per-message', type=int, default=1)
+    parser.add_argument('--page-size', type=int, default=50, help='Rows loaded per list scroll')
+    parser.add_argument('--layout', choices=('column', 'row'), default='column', help='column = reading pane, row = message replaces list')
+    parser.add_argument('--virtualize', type=int, default=0, help='Keep at most N rows in the DOM (0 = keep all)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of message/attachment requests that fail with 503')
+    parser.add_argument('--port', type=int, default=8025)
+    args = parser.parse_args()
+
+    server = MockMailServer(
+        folders=parse_folders(args.folders),
+        latency=args.latency,
+        attachment_every=args.attachment_every,
+        attachments_per_message=args.attachments_per_message,
+        page_size=args.page_size,
+        layout=args.layout,
+        virtualize=args.virtualize,
+        error_rate=args.error_rate,
+        port=args.port
+    ).start()
+    print(f"Mock mail app on {server.login_url} (any username/password)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
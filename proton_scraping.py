@@ -1,58 +1,1907 @@
 import os
 import json
+import asyncio
 import time
 import re
-from datetime import datetime, timedelta
+import gzip
+import queue
+import heapq
+import random
+import hashlib
+import socket
+import sqlite3
+import tempfile
+import threading
+import weakref
+import mimetypes
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
+from html import unescape
+from urllib.parse import unquote_to_bytes, urlparse
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeout
 import base64
 import email
+import mailbox
 from email import policy
+from email.generator import BytesGenerator
 from email.parser import BytesParser
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Reads every field of the open message in a single browser round-trip. The body
+# is read once as HTML; each distinct inline image (data: URI, or blob: URL read
+# back as data) is sent once and its src replaced by an inline-image:N placeholder
+EXTRACT_MESSAGE_JS = """
+async () => {
+    const text = (sel) => {
+        const el = document.querySelector(sel);
+        return el ? el.innerText.trim() : null;
+    };
+    const body = document.querySelector('[data-testid="message-content"]');
+    let html = body ? body.innerHTML : '';
+    const images = [];
+    if (body) {
+        const sources = new Set(Array.from(body.querySelectorAll('img[src^="data:"], img[src^="blob:"]'))
+            .map((img) => img.getAttribute('src')));
+        for (const src of sources) {
+            const attr = 'src="' + src + '"';
+            if (!html.includes(attr)) {
+                continue;
+            }
+            let data = src;
+            if (src.startsWith('blob:')) {
+                try {
+                    const blob = await (await fetch(src)).blob();
+                    data = await new Promise((resolve, reject) => {
+                        const reader = new FileReader();
+                        reader.onload = () => resolve(reader.result);
+                        reader.onerror = reject;
+                        reader.readAsDataURL(blob);
+                    });
+                } catch (e) {
+                    continue;
+                }
+            }
+            html = html.split(attr).join('src="inline-image:' + images.length + '"');
+            images.push(data);
+        }
+    }
+    return {
+        subject: text('[data-testid="message-header-subject"]'),
+        from: text('[data-testid="message-header-from"]'),
+        date: text('[data-testid="message-header-date"]'),
+        body_html: html,
+        inline_images: images,
+        attachments: Array.from(document.querySelectorAll('[data-testid^="attachment-"]'))
+            .map((el) => el.innerText.trim())
+            .filter((name) => name),
+    };
+}
+"""
+
+# Reads the metadata of every rendered message-item row in a single round-trip
+EXTRACT_LIST_ROWS_JS = """
+() => Array.from(document.querySelectorAll('[data-testid="message-item"]')).map((row, index) => {
+    const text = (sel) => {
+        const el = row.querySelector(sel);
+        return el ? el.innerText.trim() : null;
+    };
+    const time = row.querySelector('time');
+    return {
+        index: index,
+        element_id: row.getAttribute('data-element-id'),
+        subject: text('[data-testid*="subject"]'),
+        sender: text('[data-testid*="sender"], [data-testid*="address"]'),
+        date: time ? (time.getAttribute('datetime') || time.innerText.trim()) : text('[data-testid*="time"]'),
+        unread: row.classList.contains('unread'),
+        text: row.innerText.trim(),
+    };
+})
+"""
+
+MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+WEEKDAYS = {'mon': 0, 'tue': 1, 'wed': 2, 'thu': 3, 'fri': 4, 'sat': 5, 'sun': 6}
+
+_TIME_RE = re.compile(r'(\d{1,2}):(\d{2})(?::\d{2})?\s*([ap]m)?')
+_MONTH_DAY_RE = re.compile(r'\b([a-z]{3})[a-z]*\.?\s+(\d{1,2})\b(?:\s+(\d{4}))?')
+_DAY_MONTH_RE = re.compile(r'\b(\d{1,2})\s+([a-z]{3})[a-z]*\.?(?:\s+(\d{4}))?')
+_NUMERIC_RE = re.compile(r'\b(\d{1,4})[/.-](\d{1,2})[/.-](\d{1,4})\b')
+_WEEKDAY_RE = re.compile(r'^([a-z]{3})[a-z]*\b')
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_cached(date_str, today):
+    """Parse one date string relative to `today`
+
+    Handles the absolute formats of the message header (Mar 4, 2024 /
+    4 Mar 2024 / 2024-03-04 / 13/03/2024, with optional weekday, ordinal
+    and time) and the relative ones of the message list (10:32, Today,
+    Yesterday, Mon, Mar 4). Numeric dates that could be either day/month
+    or month/day (03/04/24) give None.
+    """
+    text = date_str.strip().lower()
+    if not text:
+        return None
+    
+    # ISO timestamps, e.g. from a <time datetime="..."> attribute
+    if text[:4].isdigit() and '-' in text[:8]:
+        try:
+            parsed = datetime.fromisoformat(text.upper().replace('Z', '+00:00'))
+            if parsed.tzinfo is not None:
+                parsed = parsed.astimezone().replace(tzinfo=None)
+            return parsed
+        except ValueError:
+            pass
+    
+    text = re.sub(r'(\d)(st|nd|rd|th)\b', r'\1', text).replace(',', ' ')
+    
+    hour, minute = 0, 0
+    time_match = _TIME_RE.search(text)
+    if time_match:
+        hour, minute, meridiem = int(time_match.group(1)), int(time_match.group(2)), time_match.group(3)
+        if meridiem == 'pm' and hour < 12:
+            hour += 12
+        elif meridiem == 'am' and hour == 12:
+            hour = 0
+        if hour > 23 or minute > 59:
+            hour, minute = 0, 0
+        text = (text[:time_match.start()] + text[time_match.end():]).replace(' at ', ' ').strip()
+    
+    day = None
+    if not text or 'today' in text:
+        day = today
+    elif 'yesterday' in text:
+        day = today - timedelta(days=1)
+    else:
+        numeric = _NUMERIC_RE.search(text)
+        month_day = _MONTH_DAY_RE.search(text)
+        day_month = _DAY_MONTH_RE.search(text)
+        try:
+            if numeric:
+                day = _numeric_date(*numeric.groups())
+            elif month_day and month_day.group(1) in MONTHS:
+                year = month_day.group(3)
+                day = _resolve_year(MONTHS[month_day.group(1)], int(month_day.group(2)), year, today)
+            elif day_month and day_month.group(2) in MONTHS:
+                year = day_month.group(3)
+                day = _resolve_year(MONTHS[day_month.group(2)], int(day_month.group(1)), year, today)
+            else:
+                weekday = _WEEKDAY_RE.match(text)
+                if weekday and weekday.group(1) in WEEKDAYS:
+                    days_ago = (today.weekday() - WEEKDAYS[weekday.group(1)]) % 7
+                    day = today - timedelta(days=days_ago)
+        except ValueError:
+            return None
+    
+    if day is None:
+        return None
+    return datetime(day.year, day.month, day.day, hour, minute)
+
+
+def _numeric_date(a, b, c):
+    """Y-M-D, or D/M/Y and M/D/Y when the order is clear from the numbers"""
+    if len(a) == 4:
+        return date(int(a), int(b), int(c))
+    if len(c) not in (2, 4):
+        return None
+    year = 2000 + int(c) if len(c) == 2 else int(c)
+    first, second = int(a), int(b)
+    if first > 12:
+        return date(year, second, first)
+    if second > 12 or first == second:
+        return date(year, first, second)
+    return None
+
+
+def _resolve_year(month, day_of_month, year, today):
+    """Dates without a year are the most recent such date not in the future"""
+    if year:
+        return date(int(year), month, day_of_month)
+    candidate = date(today.year, month, day_of_month)
+    if candidate > today:
+        candidate = date(today.year - 1, month, day_of_month)
+    return candidate
+
+
+# Marks the message currently shown so the next open can tell when it was replaced
+MARK_OPEN_MESSAGE_JS = """
+() => {
+    const content = document.querySelector('[data-testid="message-content"]');
+    if (!content) {
+        return null;
+    }
+    content.setAttribute('data-scraper-seen', '1');
+    const text = (sel) => {
+        const el = document.querySelector(sel);
+        return el ? el.innerText.trim() : '';
+    };
+    return [text('[data-testid="message-header-subject"]'), text('[data-testid="message-header-from"]'),
+            text('[data-testid="message-header-date"]')].join('\\n');
+}
+"""
+
+# True once a message other than the marked one is shown. The URL is not
+# compared: the app updates it on click, before the new message renders
+MESSAGE_CHANGED_JS = """
+(previous) => {
+    const content = document.querySelector('[data-testid="message-content"]');
+    if (!content) {
+        return false;
+    }
+    if (previous === null || !content.hasAttribute('data-scraper-seen')) {
+        return true;
+    }
+    const text = (sel) => {
+        const el = document.querySelector(sel);
+        return el ? el.innerText.trim() : '';
+    };
+    return [text('[data-testid="message-header-subject"]'), text('[data-testid="message-header-from"]'),
+            text('[data-testid="message-header-date"]')].join('\\n') !== previous;
+}
+"""
+
+# Scrolls the last rendered row into view, or with 'up' moves the list back
+# by a screen (works for window and container scrolling)
+SCROLL_LIST_JS = """
+(direction) => {
+    const rows = document.querySelectorAll('[data-testid="message-item"]');
+    if (!rows.length) {
+        return;
+    }
+    if (direction !== 'up') {
+        rows[rows.length - 1].scrollIntoView({block: 'end'});
+        return;
+    }
+    let box = rows[0].parentElement;
+    while (box && box !== document.body && box.scrollHeight <= box.clientHeight) {
+        box = box.parentElement;
+    }
+    if (box && box !== document.body) {
+        box.scrollTop -= box.clientHeight;
+    } else {
+        window.scrollBy(0, -window.innerHeight);
+    }
+}
+"""
+
+# Scroll offsets of the message list, or restores given ones (after back navigation)
+LIST_SCROLL_JS = """
+(restore) => {
+    const row = document.querySelector('[data-testid="message-item"]');
+    let box = row ? row.parentElement : null;
+    while (box && box !== document.body && box.scrollHeight <= box.clientHeight) {
+        box = box.parentElement;
+    }
+    if (box === document.body) {
+        box = null;
+    }
+    if (restore) {
+        window.scrollTo(0, restore.window);
+        if (box) {
+            box.scrollTop = restore.list;
+        }
+        return restore;
+    }
+    return {window: window.scrollY, list: box ? box.scrollTop : 0};
+}
+"""
+
+# True once the rendered list no longer ends (or starts) with the given row
+LIST_CHANGED_JS = """
+([edge, signature]) => {
+    const rows = document.querySelectorAll('[data-testid="message-item"]');
+    if (!rows.length) {
+        return false;
+    }
+    const row = edge === 'first' ? rows[0] : rows[rows.length - 1];
+    return (row.getAttribute('data-element-id') || row.innerText.trim()) !== signature;
+}
+"""
+
+# Marks the rendered list rows; returns the URL and the first row's signature
+MARK_LIST_JS = """
+() => {
+    const rows = document.querySelectorAll('[data-testid="message-item"]');
+    rows.forEach((row) => row.setAttribute('data-scraper-folder', '1'));
+    const first = rows[0];
+    return [location.href, first ? (first.getAttribute('data-element-id') || first.innerText.trim()) : null];
+}
+"""
+
+# True once the list shows another folder than the marked one: its rows were
+# re-rendered or the first row changed, or it emptied under a new URL
+FOLDER_CHANGED_JS = """
+([url, signature]) => {
+    const rows = document.querySelectorAll('[data-testid="message-item"]');
+    if (!rows.length) {
+        return location.href !== url;
+    }
+    if (!document.querySelector('[data-testid="message-item"][data-scraper-folder]')) {
+        return true;
+    }
+    return (rows[0].getAttribute('data-element-id') || rows[0].innerText.trim()) !== signature;
+}
+"""
+
+
+# Plain text from body HTML: cheap regex passes instead of a DOM read or a full parser
+_INVISIBLE_RE = re.compile(r'<(script|style|head|title)\b.*?</\1\s*>|<!--.*?-->', re.IGNORECASE | re.DOTALL)
+_WHITESPACE_RE = re.compile(r'\s+')
+_LINE_BREAK_RE = re.compile(r'<br\s*/?>|</?(?:p|div|li|tr|h[1-6]|blockquote|pre|table|ul|ol|hr)\b[^>]*>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]+>')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+# Inline images in body HTML: placeholders left by EXTRACT_MESSAGE_JS, and data: URIs
+_INLINE_IMAGE_RE = re.compile(r'src="inline-image:(\d+)"')
+_DATA_IMAGE_RE = re.compile(r'src="(data:image/[^"]*)"', re.IGNORECASE)
+
+
+def html_to_text(html):
+    """Plain text of an HTML fragment, with block elements on their own lines"""
+    text = _INVISIBLE_RE.sub('', html)
+    text = _WHITESPACE_RE.sub(' ', text)
+    text = _LINE_BREAK_RE.sub('\n', text)
+    text = unescape(_TAG_RE.sub('', text))
+    text = "\n".join(line.strip() for line in text.split('\n'))
+    return _BLANK_LINES_RE.sub('\n\n', text).strip()
+
+
+class MessageBody:
+    """Body of an extracted message, read from the page once as HTML
+
+    Inline images are moved out of the HTML into parts referenced by cid:,
+    one per distinct image, so a logo repeated in a thread is stored once
+    and never base64-encoded twice. The plain text is derived from the HTML
+    only when something asks for it, and then kept.
+    """
+    
+    def __init__(self, html, inline_images=()):
+        # cid -> (maintype, subtype, data)
+        self.images = {}
+        cids = [self._add_image(uri) for uri in inline_images]
+        
+        def placeholder(match):
+            n = int(match.group(1))
+            cid = cids[n] if n < len(cids) else None
+            if cid is None:
+                return f'src="{inline_images[n]}"' if n < len(inline_images) else match.group(0)
+            return f'src="cid:{cid}"'
+        
+        def data_image(match):
+            cid = self._add_image(unescape(match.group(1)))
+            return f'src="cid:{cid}"' if cid else match.group(0)
+        
+        html = _INLINE_IMAGE_RE.sub(placeholder, html or '')
+        self.html = _DATA_IMAGE_RE.sub(data_image, html)
+        self._text = None
+    
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = html_to_text(self.html)
+        return self._text
+    
+    def _add_image(self, uri):
+        """Decode a data: URI into an image part; returns its cid, or None"""
+        header, sep, payload = uri.partition(',')
+        if not sep or not header.lower().startswith('data:image/'):
+            return None
+        params = header[5:].split(';')
+        try:
+            if 'base64' in (p.strip().lower() for p in params[1:]):
+                data = base64.b64decode(payload)
+            else:
+                data = unquote_to_bytes(payload)
+        except ValueError:
+            return None
+        maintype, _, subtype = params[0].strip().lower().partition('/')
+        cid = f"{hashlib.sha256(data).hexdigest()[:24]}@inline"
+        self.images.setdefault(cid, (maintype, subtype or 'octet-stream', data))
+        return cid
+
+
+class RowNotReachable(Exception):
+    """A harvested list row could not be brought back into the rendered list"""
+
+
+class MessageListHarvester:
+    """Walk a message list and yield every row exactly once
+
+    Rows are collected from whatever is rendered after each scroll or page
+    step and deduplicated by id, so rows that a virtualized list drops from
+    the DOM are not lost and each step only reads the rendered window.
+    After iteration `complete` tells whether the folder was covered to its
+    end (or to the cutoff date) and `stop_reason` says why it stopped; a
+    scroll that lands on rows sharing nothing with those already read means
+    rows were skipped, and the folder is then reported incomplete.
+    """
+    NEXT_PAGE_SELECTOR = '[data-testid="pagination-row:go-to-next-page"]'
+    
+    def __init__(self, scraper, page, folder, max_steps=2000, stall_limit=3):
+        self.scraper = scraper
+        self.page = page
+        self.folder = folder
+        self.max_steps = max_steps
+        self.stall_limit = stall_limit
+        self.seen = set()
+        # key -> position of every yielded row, so rows can be found again
+        self.positions = {}
+        # Set when a scroll landed on rows that share nothing with what was read
+        self.gap = False
+        self.count = 0
+        self.complete = False
+        self.stop_reason = None
+    
+    @staticmethod
+    def row_key(row, occurrence=1):
+        """Identity of a list row: the app's id, or a hash of the row's text and date
+
+        Rows without an id that are identical (same text and date) are told
+        apart by `occurrence`, their number among the identical rows rendered
+        together.
+        """
+        if row.get('element_id'):
+            return row['element_id']
+        source = f"{row.get('text') or ''}\n{row.get('date') or ''}"
+        key = "r" + hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+        return key if occurrence == 1 else f"{key}.{occurrence}"
+    
+    @classmethod
+    def row_keys(cls, rows):
+        """(key, occurrence) of every row in a rendered batch, in list order"""
+        counts = {}
+        keyed = []
+        for row in rows:
+            key = cls.row_key(row)
+            counts[key] = counts.get(key, 0) + 1
+            keyed.append((cls.row_key(row, counts[key]), counts[key]))
+        return keyed
+    
+    @staticmethod
+    def _signature(row):
+        return row.get('element_id') or row.get('text') or ''
+    
+    def __iter__(self):
+        stalls = 0
+        # The first batch and a new page need not overlap the rows before them
+        fresh = True
+        for step in range(self.max_steps):
+            rows = self.scraper.extract_list_rows(self.page)
+            keyed = self.row_keys(rows)
+            if rows and not fresh and not any(key in self.seen for key, _ in keyed):
+                self.gap = True
+            fresh = False
+            
+            for row, (key, occurrence) in zip(rows, keyed):
+                if key in self.seen:
+                    continue
+                self.seen.add(key)
+                
+                # Rows are newest first, so the first one past the cutoff ends the folder.
+                # A list date without a time parses to midnight, so on the cutoff's own
+                # day it is only compared by day and the header check makes the call
+                cutoff = self.scraper.cutoff_date
+                row_date = self.scraper.parse_date(row.get('date'))
+                if row_date and not _TIME_RE.search(row['date']):
+                    row_date, cutoff = row_date.date(), cutoff.date()
+                if row_date and row_date < cutoff:
+                    self._finish(True, f"reached cutoff at: {(row.get('subject') or '')[:50]}")
+                    return
+                
+                self.count += 1
+                self.positions[key] = self.count
+                yield {**row, 'key': key, 'position': self.count, 'occurrence': occurrence}
+            
+            if not rows:
+                self._finish(True, "list is empty")
+                return
+            
+            if self._scroll(rows):
+                stalls = 0
+                continue
+            if self._next_page(rows):
+                stalls = 0
+                fresh = True
+                continue
+            
+            stalls += 1
+            if stalls >= self.stall_limit:
+                self._finish(True, "end of list")
+                return
+        
+        self._finish(False, f"step limit of {self.max_steps} reached")
+    
+    def _scroll(self, rows):
+        """Scroll past the last rendered row; True if the list moved"""
+        with self.scraper.metrics.timer('list_scroll', folder=self.folder['name']):
+            self.page.evaluate(SCROLL_LIST_JS)
+            return self.scraper.wait_for(
+                self.page, 'list_scroll',
+                function=LIST_CHANGED_JS,
+                arg=['last', self._signature(rows[-1])]
+            )
+    
+    def _next_page(self, rows):
+        """Go to the next page of a paginated list; True if there was one"""
+        button = self.page.locator(self.NEXT_PAGE_SELECTOR).first
+        try:
+            if button.count() == 0 or not button.is_enabled():
+                return False
+            button.click()
+        except Exception:
+            return False
+        with self.scraper.metrics.timer('list_page', folder=self.folder['name']):
+            return self.scraper.wait_for(
+                self.page, 'list_page',
+                function=LIST_CHANGED_JS,
+                arg=['first', self._signature(rows[0])]
+            )
+    
+    def _finish(self, complete, reason):
+        if complete and self.gap:
+            complete, reason = False, f"{reason}, but the list skipped rows it never rendered"
+        self.complete = complete
+        self.stop_reason = reason
+
+
+class BackgroundWriter:
+    """Save extracted messages on a background thread
+
+    Extraction puts messages on a bounded queue, so memory stays constant
+    however large a folder is, disk writes overlap with browser work, and
+    each message is on disk as soon as the writer reaches it.
+    """
+    _STOP = object()
+    
+    def __init__(self, save, queue_size=100):
+        self.save = save
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.failed = 0
+        self.failures = []
+        self._failures_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="eml-writer", daemon=True)
+        self.thread.start()
+    
+    def put(self, email_data):
+        """Queue a message for saving (blocks while the queue is full)"""
+        self.queue.put(email_data)
+    
+    def flush(self):
+        """Wait until every queued message has been saved"""
+        self.queue.join()
+    
+    def take_failures(self, folder_name):
+        """Remove and return the (email_data, error) pairs that failed in a folder"""
+        with self._failures_lock:
+            taken = [f for f in self.failures if f[0]['folder'] == folder_name]
+            self.failures = [f for f in self.failures if f[0]['folder'] != folder_name]
+        return taken
+    
+    def close(self):
+        """Save what is left and stop the writer thread"""
+        self.queue.put(self._STOP)
+        self.thread.join()
+    
+    def _run(self):
+        while True:
+            email_data = self.queue.get()
+            try:
+                if email_data is self._STOP:
+                    return
+                self.save(email_data)
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                with self._failures_lock:
+                    self.failures.append((email_data, e))
+                print(f"[{datetime.now()}] Failed to save {email_data.get('subject', '')[:50]}: {e}")
+            finally:
+                self.queue.task_done()
+
+
+class CheckpointStore:
+    """Per-message scrape checkpoints in SQLite (WAL mode)
+
+    Every saved message is recorded as it is written and commits are
+    batched, so a crash loses at most one batch and a restarted folder
+    skips everything that is already on disk.
+    """
+    
+    def __init__(self, path, batch_size=50, max_delay=5.0):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self.conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                row_key TEXT,
+                saved_at TEXT NOT NULL,
+                PRIMARY KEY (account, folder, message_id)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS messages_row_key ON messages (account, folder, row_key)")
+        self.conn.commit()
+    
+    def record_message(self, account_email, folder_name, message_id, row_key=None):
+        """Record a saved message; committed with the current batch"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)",
+                (account_email, folder_name, message_id, row_key, datetime.now().isoformat())
+            )
+            self._pending += 1
+            if self._pending >= self.batch_size or time.monotonic() - self._last_commit >= self.max_delay:
+                self._commit()
+    
+    def flush(self):
+        """Commit the current batch"""
+        with self._lock:
+            self._commit()
+    
+    def _commit(self):
+        self.conn.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+    
+    def saved_messages(self, account_email, folder_name):
+        """Return (message ids, row keys) already saved for a folder"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT message_id, row_key FROM messages WHERE account = ? AND folder = ?",
+                (account_email, folder_name)
+            ).fetchall()
+        return {row[0] for row in rows}, {row[1] for row in rows if row[1]}
+    
+    def clear_folder(self, account_email, folder_name):
+        """Forget the checkpoints of one folder"""
+        with self._lock:
+            self.conn.execute("DELETE FROM messages WHERE account = ? AND folder = ?", (account_email, folder_name))
+            self._commit()
+    
+    def clear_account(self, account_email):
+        """Forget the checkpoints of a finished account"""
+        with self._lock:
+            self.conn.execute("DELETE FROM messages WHERE account = ?", (account_email,))
+            self._commit()
+    
+    def close(self):
+        with self._lock:
+            self._commit()
+            self.conn.close()
+
+
+class BrowserManager:
+    """One long-lived browser that hands out configured contexts
+
+    Use it as a context manager from the thread that drives the browser
+    (the sync Playwright API is bound to that thread), so concurrent
+    workers each run their own BrowserManager, i.e. their own Chromium
+    process, not contexts of a shared browser. Every context gets
+    request routing that aborts the configured resource types and any
+    content from hosts outside ProtonMail, except on the login and
+    verification pages where CAPTCHAs must render (plus the pages whose
+    URL starts with one of `unblocked_pages`, e.g. a custom login URL).
+    """
+    ALLOWED_DOMAINS = ('proton.me', 'protonmail.com', 'protonmail.ch')
+    UNBLOCKED_PAGE_HOSTS = ('account.proton.me', 'verify.proton.me')
+    
+    def __init__(self, headless=False, block_resources=('image', 'media', 'font'),
+                 block_remote_content=True, viewport=None, extra_hosts=(), unblocked_pages=()):
+        self.headless = headless
+        self.block_resources = set(block_resources or ())
+        self.block_remote_content = block_remote_content
+        self.viewport = viewport or {'width': 1280, 'height': 800}
+        # Hosts of a non-default login/mail URL are not remote content, but
+        # only the login page itself (by URL prefix) loads without blocking
+        self.allowed_domains = self.ALLOWED_DOMAINS + tuple(extra_hosts)
+        self.unblocked_pages = tuple(unblocked_pages)
+        self.playwright = None
+        self.browser = None
+        self.blocked = 0
+    
+    def __enter__(self):
+        self.playwright = sync_playwright().start()
+        self.browser = self.playwright.chromium.launch(
+            headless=self.headless,
+            args=[
+                '--disable-gpu',
+                '--disable-dev-shm-usage',
+                '--disable-extensions',
+                '--mute-audio',
+                '--no-first-run',
+            ]
+        )
+        return self
+    
+    def __exit__(self, *exc):
+        try:
+            self.browser.close()
+        finally:
+            self.playwright.stop()
+        if self.blocked:
+            print(f"[{datetime.now()}] Blocked {self.blocked} requests")
+    
+    def new_context(self, storage_state=None):
+        """Create a context in this manager's browser"""
+        context = self.browser.new_context(
+            viewport=self.viewport,
+            device_scale_factor=1,
+            user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            storage_state=storage_state
+        )
+        if self.block_resources or self.block_remote_content:
+            context.route("**/*", self._route)
+        return context
+    
+    def _route(self, route):
+        request = route.request
+        if self._should_block(request):
+            self.blocked += 1
+            route.abort()
+        else:
+            route.continue_()
+    
+    def _should_block(self, request):
+        if request.resource_type == 'document' and request.is_navigation_request():
+            return False
+        try:
+            page_url = request.frame.url
+        except Exception:
+            page_url = ''
+        if urlparse(page_url).hostname in self.UNBLOCKED_PAGE_HOSTS or page_url.startswith(self.unblocked_pages):
+            return False
+        if request.resource_type in self.block_resources:
+            return True
+        if self.block_remote_content:
+            host = urlparse(request.url).hostname or ''
+            if request.url.startswith(('data:', 'blob:')):
+                return False
+            return not any(host == d or host.endswith('.' + d) for d in self.allowed_domains)
+        return False
+
+
+class ContentStore:
+    """Content-addressed object store for message bodies and attachments
+
+    Every object is stored once under the SHA-256 of its content, so a
+    message that shows up in several folders or runs costs one write.
+    Objects can be compressed with gzip or zstd (needs the `zstandard`
+    package); the hash is always taken over the uncompressed bytes.
+    """
+    SUFFIXES = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+    
+    def __init__(self, root, compression=None):
+        if compression not in self.SUFFIXES:
+            raise ValueError(f"Unknown compression: {compression}")
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+        self.root = Path(root)
+        self.compression = compression
+        self.written = 0
+        self.deduplicated = 0
+    
+    def object_path(self, digest):
+        return self.root / digest[:2] / (digest[2:] + self.SUFFIXES[self.compression])
+    
+    def put_bytes(self, data):
+        """Store bytes and return their hash"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if path.exists():
+            self.deduplicated += 1
+            return digest
+        
+        if self.compression == 'gzip':
+            data = gzip.compress(data, compresslevel=6)
+        elif self.compression == 'zstd':
+            data = zstandard.ZstdCompressor(level=10).compress(data)
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.written += 1
+        return digest
+    
+    def put_file(self, path, remove=False):
+        """Store a file's content and return its hash"""
+        path = Path(path)
+        digest = self.put_bytes(path.read_bytes())
+        if remove:
+            path.unlink()
+        return digest
+    
+    def get(self, digest):
+        """Read an object back as uncompressed bytes
+
+        Objects written with a different compression setting are found too.
+        """
+        for compression, suffix in self.SUFFIXES.items():
+            path = self.root / digest[:2] / (digest[2:] + suffix)
+            if path.exists():
+                break
+        else:
+            raise FileNotFoundError(f"No object {digest} in {self.root}")
+        data = path.read_bytes()
+        if compression == 'gzip':
+            return gzip.decompress(data)
+        if compression == 'zstd':
+            return zstandard.ZstdDecompressor().decompress(data)
+        return data
+
+
+class MboxBackend:
+    """Append messages to one mbox file per account folder
+
+    Writes go through large buffered file handles and reach the disk in
+    batches, on flush() or once `batch_size` messages are pending. Each
+    message's on_durable callback runs only after its batch is fsynced, so
+    nothing is recorded as saved while it still sits in a buffer. Lines
+    starting with "From " are escaped the mboxrd way.
+    """
+    
+    def __init__(self, root, batch_size=200, buffer_size=1024 * 1024):
+        self.root = Path(root)
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self._files = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+    
+    def save(self, msg, account_dir, folder_name, on_durable=None):
+        path = self.root / account_dir / f"{folder_name.replace('/', '_')}.mbox"
+        data = msg.as_bytes()
+        data = re.sub(rb'^(>*From )', rb'>\1', data, flags=re.MULTILINE)
+        if not data.endswith(b"\n"):
+            data += b"\n"
+        separator = f"From MAILER-DAEMON {time.asctime()}\n".encode('ascii')
+        
+        with self._lock:
+            f = self._files.get(path)
+            if f is None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                f = self._files[path] = open(path, 'ab', buffering=self.buffer_size)
+            f.write(separator + data + b"\n")
+            self._callbacks.append((on_durable, path))
+            durable = self._flush() if len(self._callbacks) >= self.batch_size else []
+        self._run_callbacks(durable)
+        return path
+    
+    def flush(self):
+        """Write buffered messages to disk and close the files"""
+        with self._lock:
+            durable = self._flush()
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+        self._run_callbacks(durable)
+    
+    def _flush(self):
+        """fsync every open file; returns the callbacks that may run now"""
+        for f in self._files.values():
+            f.flush()
+            os.fsync(f.fileno())
+        durable, self._callbacks = self._callbacks, []
+        return durable
+    
+    @staticmethod
+    def _run_callbacks(durable):
+        for on_durable, path in durable:
+            if on_durable is not None:
+                on_durable(path)
+
+
+class MaildirBackend:
+    """Deliver messages into one Maildir per account folder"""
+    
+    def __init__(self, root):
+        self.root = Path(root)
+        self._boxes = {}
+        self._lock = threading.Lock()
+    
+    def save(self, msg, account_dir, folder_name, on_durable=None):
+        path = self.root / account_dir / "maildir" / folder_name.replace('/', '_')
+        with self._lock:
+            box = self._boxes.get(path)
+            if box is None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                box = self._boxes[path] = mailbox.Maildir(str(path), create=True)
+            key = box.add(msg)
+        path = path / "new" / key
+        if on_durable is not None:
+            on_durable(path)
+        return path
+    
+    def flush(self):
+        with self._lock:
+            self._boxes = {}
+
+
+class SearchIndex:
+    """Full-text search over saved messages (SQLite FTS5)
+
+    Subject, sender, date, folder, body text and attachment names are
+    indexed; each hit points back to the file the message was saved to.
+    Writes are committed in batches like the checkpoint store.
+    """
+    
+    def __init__(self, path, batch_size=200, max_delay=5.0):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self.conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                subject TEXT,
+                sender TEXT,
+                date TEXT,
+                UNIQUE (account, folder, message_id)
+            )
+        """)
+        self.conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+                subject, sender, date, folder, body, attachments,
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+        self.conn.commit()
+    
+    def add(self, account_email, folder_name, message_id, path, subject, sender, date_str, body, attachments):
+        """Index one message, replacing an earlier entry for the same message"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT id FROM documents WHERE account = ? AND folder = ? AND message_id = ?",
+                (account_email, folder_name, message_id)
+            ).fetchone()
+            if row:
+                self.conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (row[0],))
+                self.conn.execute(
+                    "UPDATE documents SET path = ?, subject = ?, sender = ?, date = ? WHERE id = ?",
+                    (str(path), subject, sender, date_str, row[0])
+                )
+                doc_id = row[0]
+            else:
+                doc_id = self.conn.execute(
+                    "INSERT INTO documents (account, folder, message_id, path, subject, sender, date) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (account_email, folder_name, message_id, str(path), subject, sender, date_str)
+                ).lastrowid
+            self.conn.execute(
+                "INSERT INTO documents_fts (rowid, subject, sender, date, folder, body, attachments) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (doc_id, subject, sender, date_str, folder_name, body, "\n".join(attachments))
+            )
+            self._pending += 1
+            if self._pending >= self.batch_size or time.monotonic() - self._last_commit >= self.max_delay:
+                self._commit()
+    
+    def search(self, query, account_email=None, folder_name=None, limit=50):
+        """Return matching messages, best match first
+
+        `query` uses FTS5 syntax, e.g. `invoice AND sender:alice`; if it does
+        not parse, its words are searched as plain terms instead.
+        """
+        sql = """
+            SELECT d.path, d.account, d.folder, d.subject, d.sender, d.date,
+                   snippet(documents_fts, 4, '[', ']', '...', 12)
+            FROM documents_fts JOIN documents d ON d.id = documents_fts.rowid
+            WHERE documents_fts MATCH ?
+        """
+        params = [query]
+        if account_email:
+            sql += " AND d.account = ?"
+            params.append(account_email)
+        if folder_name:
+            sql += " AND d.folder = ?"
+            params.append(folder_name)
+        sql += " ORDER BY bm25(documents_fts) LIMIT ?"
+        params.append(limit)
+        
+        with self._lock:
+            try:
+                rows = self.conn.execute(sql, params).fetchall()
+            except sqlite3.OperationalError:
+                params[0] = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+                rows = self.conn.execute(sql, params).fetchall()
+        
+        keys = ('path', 'account', 'folder', 'subject', 'from', 'date', 'snippet')
+        return [dict(zip(keys, row)) for row in rows]
+    
+    def clear(self):
+        """Drop every indexed message"""
+        with self._lock:
+            self.conn.execute("DELETE FROM documents")
+            self.conn.execute("DELETE FROM documents_fts")
+            self._commit()
+    
+    def flush(self):
+        with self._lock:
+            self._commit()
+    
+    def _commit(self):
+        self.conn.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+    
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+class SqliteWorkQueue:
+    """Shared queue of account and folder units for several scraper workers
+
+    Workers on any number of hosts open the same database (for example on
+    a shared volume) and claim units under a lease that they keep alive
+    with heartbeats. A unit whose lease runs out, because its worker died
+    or lost the volume, goes back to whoever claims next, so workers can
+    join and leave at any time. Account units discover an account's
+    folders and add them as folder units; a unit that fails max_attempts
+    times is parked as failed.
+
+    Any object with the same methods (register_worker, claim, heartbeat,
+    add_folders, complete, fail, drained, leave) can stand in as the
+    queue backend for ProtonMailScraper.run_worker.
+    """
+    
+    def __init__(self, path, max_attempts=3):
+        self.path = Path(path)
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Rollback journal rather than WAL: WAL needs shared memory, which
+        # network filesystems do not provide. Transactions are explicit.
+        self.conn = sqlite3.connect(str(self.path), timeout=60, check_same_thread=False, isolation_level=None)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS units (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                account TEXT NOT NULL,
+                folder TEXT NOT NULL DEFAULT '',
+                payload TEXT,
+                state TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL,
+                UNIQUE (kind, account, folder)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS units_state ON units (state, lease_expires)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS workers (
+                id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                started_at REAL,
+                last_seen REAL,
+                units_done INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+    
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+    
+    def add_accounts(self, emails, requeue=False):
+        """Queue one unit per account; with requeue, finished accounts are queued again"""
+        emails = list(emails)
+        if not emails:
+            return
+        now = time.time()
+        with self._transaction() as conn:
+            if requeue:
+                placeholders = ",".join("?" * len(emails))
+                conn.execute(f"DELETE FROM units WHERE kind = 'folder' AND account IN ({placeholders})", list(emails))
+                conn.execute(
+                    f"UPDATE units SET state = 'pending', worker = NULL, lease_expires = NULL, attempts = 0, "
+                    f"error = NULL, updated_at = ? WHERE kind = 'account' AND account IN ({placeholders})",
+                    [now, *emails]
+                )
+            conn.executemany(
+                "INSERT OR IGNORE INTO units (kind, account, updated_at) VALUES ('account', ?, ?)",
+                [(email, now) for email in emails]
+            )
+    
+    def add_folders(self, account_email, folders):
+        """Queue one unit per folder of an account (existing units are kept)"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO units (kind, account, folder, payload, updated_at) VALUES ('folder', ?, ?, ?, ?)",
+                [(account_email, folder['name'], json.dumps({**folder, 'position': idx, 'count': len(folders)}), now)
+                 for idx, folder in enumerate(folders)]
+            )
+    
+    def register_worker(self, worker_id):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (id, state, started_at, last_seen) VALUES (?, 'active', ?, ?)",
+                (worker_id, now, now)
+            )
+    
+    def claim(self, worker_id, lease_seconds, accounts=None, prefer_accounts=()):
+        """Lease the next available unit, or return None
+
+        Pending units and units whose lease has expired are available.
+        Folder units of prefer_accounts (accounts the worker is already
+        logged in to) come first, then other folder units, then accounts.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            # Units that keep losing their lease are given up on
+            conn.execute(
+                "UPDATE units SET state = 'failed', error = 'lease expired ' || attempts || ' times', updated_at = ? "
+                "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            query = ("SELECT id, kind, account, folder, payload, attempts FROM units "
+                     "WHERE (state = 'pending' OR (state = 'leased' AND lease_expires < ?))")
+            params = [now]
+            if accounts is not None:
+                query += f" AND account IN ({','.join('?' * len(accounts))})"
+                params += list(accounts)
+            prefer = list(prefer_accounts)
+            if prefer:
+                query += f" ORDER BY (kind = 'folder' AND account IN ({','.join('?' * len(prefer))})) DESC,"
+                params += prefer
+            else:
+                query += " ORDER BY"
+            query += " kind = 'folder' DESC, id LIMIT 1"
+            row = conn.execute(query, params).fetchone()
+            if row is None:
+                conn.execute("UPDATE workers SET last_seen = ? WHERE id = ?", (now, worker_id))
+                return None
+            conn.execute(
+                "UPDATE units SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row[0])
+            )
+            conn.execute("UPDATE workers SET last_seen = ? WHERE id = ?", (now, worker_id))
+        return {
+            'id': row[0], 'kind': row[1], 'account': row[2], 'folder': row[3],
+            'payload': json.loads(row[4]) if row[4] else None, 'attempt': row[5] + 1
+        }
+    
+    def heartbeat(self, unit_id, worker_id, lease_seconds):
+        """Extend a lease; False if the worker no longer holds it"""
+        now = time.time()
+        with self._transaction() as conn:
+            held = conn.execute(
+                "UPDATE units SET lease_expires = ?, updated_at = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                (now + lease_seconds, now, unit_id, worker_id)
+            ).rowcount == 1
+            conn.execute("UPDATE workers SET last_seen = ? WHERE id = ?", (now, worker_id))
+        return held
+    
+    def complete(self, unit_id, worker_id):
+        """Mark a unit done if this worker still holds its lease; False (and unchanged) otherwise"""
+        now = time.time()
+        with self._transaction() as conn:
+            held = conn.execute(
+                "UPDATE units SET state = 'done', lease_expires = NULL, error = NULL, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND state = 'leased'",
+                (now, unit_id, worker_id)
+            ).rowcount == 1
+            if held:
+                conn.execute("UPDATE workers SET last_seen = ?, units_done = units_done + 1 WHERE id = ?", (now, worker_id))
+        return held
+    
+    def fail(self, unit_id, worker_id, error):
+        """Hand a failed unit back to the queue, or park it after max_attempts"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker = NULL, lease_expires = NULL, error = ?, updated_at = ? WHERE id = ? AND worker = ?",
+                (self.max_attempts, str(error)[:500], now, unit_id, worker_id)
+            )
+    
+    def leave(self, worker_id):
+        """Deregister a worker and give its leased units back right away"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE units SET state = 'pending', worker = NULL, lease_expires = NULL, "
+                "attempts = MAX(attempts - 1, 0), updated_at = ? WHERE worker = ? AND state = 'leased'",
+                (now, worker_id)
+            )
+            conn.execute("UPDATE workers SET state = 'left', last_seen = ? WHERE id = ?", (now, worker_id))
+    
+    def drained(self, accounts=None):
+        """True once no unit (of the given accounts) is pending or leased"""
+        query = "SELECT COUNT(*) FROM units WHERE state IN ('pending', 'leased')"
+        params = []
+        if accounts is not None:
+            query += f" AND account IN ({','.join('?' * len(accounts))})"
+            params = list(accounts)
+        with self._lock:
+            row = self.conn.execute(query, params).fetchone()
+        return row[0] == 0
+    
+    def status(self):
+        """Unit counts per kind and state, failed units and known workers"""
+        with self._lock:
+            counts = self.conn.execute("SELECT kind, state, COUNT(*) FROM units GROUP BY kind, state").fetchall()
+            failed = self.conn.execute(
+                "SELECT kind, account, folder, attempts, error FROM units WHERE state = 'failed' ORDER BY id"
+            ).fetchall()
+            workers = self.conn.execute(
+                "SELECT id, state, started_at, last_seen, units_done FROM workers ORDER BY started_at"
+            ).fetchall()
+        summary = {}
+        for kind, state, n in counts:
+            summary.setdefault(kind, {})[state] = n
+        return {
+            'units': summary,
+            'failed': [dict(zip(('kind', 'account', 'folder', 'attempts', 'error'), row)) for row in failed],
+            'workers': [dict(zip(('id', 'state', 'started_at', 'last_seen', 'units_done'), row)) for row in workers],
+        }
+    
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class LeaseHeartbeat:
+    """Keep a work unit's lease alive from a background thread"""
+    
+    def __init__(self, work_queue, unit_id, worker_id, lease_seconds):
+        self.work_queue = work_queue
+        self.unit_id = unit_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{unit_id}", daemon=True)
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+    
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                if not self.work_queue.heartbeat(self.unit_id, self.worker_id, self.lease_seconds):
+                    self.lost = True
+                    print(f"[{datetime.now()}] ⚠️  Lost the lease on unit {self.unit_id}; another worker may redo it")
+                    return
+            except sqlite3.Error as e:
+                print(f"[{datetime.now()}] Heartbeat for unit {self.unit_id} failed: {e}")
+
+
+class RunMetrics:
+    """Timers, counters and structured logs for a scraper run
+
+    Stages (login, folder, list scroll, message open/extract/save, ...) are
+    timed with `timer()` and aggregated per stage and label set into
+    count/total/max and a latency histogram; `count()` keeps counters such
+    as saved messages and errors. Every finished stage is also appended to
+    a JSON-lines event log, and per-message traces go to their own file
+    when enabled. The aggregate can be exported as JSON or in the
+    Prometheus text format.
+    """
+    # Upper bounds (seconds) of the latency histogram buckets
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+    
+    def __init__(self, log_path=None, trace_path=None):
+        self.run_id = datetime.now().strftime('%Y%m%dT%H%M%S')
+        self.started = time.time()
+        self.timers = {}
+        self.counters = {}
+        self.log_path = log_path
+        self.trace_path = trace_path
+        self._files = {}
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def timer(self, stage, spans=None, **labels):
+        """Time a block as one occurrence of a stage
+
+        Exceptions are counted as errors of the stage and re-raised. When a
+        spans dict is given the duration is also stored in it under the
+        stage name, for per-message traces.
+        """
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if spans is not None:
+                spans[stage] = round(elapsed, 4)
+            self.observe(stage, elapsed, error, **labels)
+    
+    def observe(self, stage, seconds, error=None, **labels):
+        """Record one occurrence of a stage that took `seconds`"""
+        key = (stage, tuple(sorted(labels.items())))
+        with self._lock:
+            stats = self.timers.get(key)
+            if stats is None:
+                stats = self.timers[key] = {
+                    'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0,
+                    'buckets': [0] * len(self.BUCKETS)
+                }
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            if error is not None:
+                stats['errors'] += 1
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][i] += 1
+                    break
+        
+        fields = {'stage': stage, 'seconds': round(seconds, 4), **labels}
+        if error is not None:
+            fields['error'] = str(error)
+        self.event('stage', **fields)
+    
+    def count(self, name, value=1, **labels):
+        """Add to a counter"""
+        if not value:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def event(self, event, **fields):
+        """Append one structured log line"""
+        if self.log_path is not None:
+            self._write(self.log_path, {'ts': datetime.now().isoformat(), 'run': self.run_id, 'event': event, **fields})
+    
+    def trace(self, **fields):
+        """Append one per-message trace line (only when traces are enabled)"""
+        if self.trace_path is not None:
+            self._write(self.trace_path, {'ts': datetime.now().isoformat(), 'run': self.run_id, **fields})
+    
+    def _write(self, path, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            f = self._files.get(path)
+            if f is None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # Line buffered, so the logs can be followed while the run is going
+                f = self._files[path] = open(path, 'a', buffering=1)
+            f.write(line)
+    
+    def stage_totals(self):
+        """count/errors/total/max per stage, summed over all label sets"""
+        totals = {}
+        with self._lock:
+            for (stage, _), stats in self.timers.items():
+                total = totals.setdefault(stage, {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+                total['count'] += stats['count']
+                total['errors'] += stats['errors']
+                total['total'] += stats['total']
+                total['max'] = max(total['max'], stats['max'])
+        return totals
+    
+    def snapshot(self):
+        """Everything measured so far as a JSON-serializable dict"""
+        with self._lock:
+            timers = [
+                {'stage': stage, 'labels': dict(labels), 'count': stats['count'],
+                 'errors': stats['errors'], 'total': round(stats['total'], 4),
+                 'avg': round(stats['total'] / stats['count'], 4), 'max': round(stats['max'], 4),
+                 'buckets': dict(zip(map(str, self.BUCKETS), stats['buckets']))}
+                for (stage, labels), stats in sorted(self.timers.items())
+            ]
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+        return {
+            'run': self.run_id,
+            'started': datetime.fromtimestamp(self.started).isoformat(),
+            'elapsed': round(time.time() - self.started, 3),
+            'timers': timers,
+            'counters': counters,
+        }
+    
+    def prometheus(self, prefix='protonmail_scraper'):
+        """The snapshot in the Prometheus text exposition format"""
+        def fmt_labels(labels, **extra):
+            pairs = list(labels) + list(extra.items())
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{name}="{self._label_value(value)}"' for name, value in pairs) + "}"
+        
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent per scraper stage",
+            f"# TYPE {prefix}_stage_seconds histogram",
+        ]
+        errors = []
+        with self._lock:
+            for (stage, labels), stats in sorted(self.timers.items()):
+                labels = (('stage', stage),) + labels
+                cumulative = 0
+                for bound, n in zip(self.BUCKETS, stats['buckets']):
+                    cumulative += n
+                    lines.append(f"{prefix}_stage_seconds_bucket{fmt_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{prefix}_stage_seconds_bucket{fmt_labels(labels, le='+Inf')} {stats['count']}")
+                lines.append(f"{prefix}_stage_seconds_sum{fmt_labels(labels)} {stats['total']:.6f}")
+                lines.append(f"{prefix}_stage_seconds_count{fmt_labels(labels)} {stats['count']}")
+                errors.append(f"{prefix}_stage_errors_total{fmt_labels(labels)} {stats['errors']}")
+            
+            lines.append(f"# HELP {prefix}_stage_errors_total Stage occurrences that raised an error")
+            lines.append(f"# TYPE {prefix}_stage_errors_total counter")
+            lines.extend(errors)
+            
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f"{prefix}_{name}_total{fmt_labels(labels)} {value}")
+        
+        lines.append(f"# TYPE {prefix}_run_seconds gauge")
+        lines.append(f"{prefix}_run_seconds {time.time() - self.started:.3f}")
+        return "\n".join(lines) + "\n"
+    
+    @staticmethod
+    def _label_value(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+
+
+class RateController:
+    """Adapt pacing and download parallelism to how the server responds
+
+    Message and attachment operations report their latency and whether they
+    failed (AIMD). While the smoothed latency stays under the target and
+    nothing fails, the pause before each message shrinks by a fixed step
+    and one more parallel download is allowed every `increase_every`
+    successes. A failure or a slow response doubles the pause and halves
+    the parallelism. Retries wait an exponential backoff with full jitter.
+    """
+    
+    def __init__(self, max_parallel=3, target_latency=3.0, delay_step=0.1, max_delay=30.0,
+                 increase_every=10, backoff_base=1.0, backoff_cap=60.0, enabled=True):
+        self.max_parallel = max(1, max_parallel)
+        self.target_latency = target_latency
+        self.delay_step = delay_step
+        self.max_delay = max_delay
+        self.increase_every = increase_every
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.enabled = enabled
+        self.delay = 0.0
+        self.parallel = self.max_parallel
+        self.latency = None
+        self.error_rate = 0.0
+        self._successes = 0
+        self._lock = threading.Lock()
+    
+    def record(self, latency, ok=True):
+        """Feed one observation; returns True if the pacing changed"""
+        with self._lock:
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            self.error_rate = 0.9 * self.error_rate + (0.0 if ok else 0.1)
+            if not self.enabled:
+                return False
+            before = (self.delay, self.parallel)
+            
+            if not ok or self.latency > self.target_latency:
+                self.delay = min(self.max_delay, max(self.delay_step, self.delay * 2))
+                self.parallel = max(1, self.parallel // 2)
+                self._successes = 0
+            else:
+                self.delay = max(0.0, self.delay - self.delay_step)
+                self._successes += 1
+                if self._successes >= self.increase_every:
+                    self._successes = 0
+                    self.parallel = min(self.max_parallel, self.parallel + 1)
+            
+            return (self.delay, self.parallel) != before
+    
+    def pace(self):
+        """Sleep for the current pause between messages"""
+        delay = self.delay
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+    
+    def account_pause(self):
+        """Pause between accounts: short while the server is healthy, longer when it pushes back"""
+        return min(60.0, max(1.0, self.delay * 10))
+    
+    def backoff(self, attempt):
+        """Seconds to wait before retry number `attempt` (1-based)"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+    
+    def state(self):
+        with self._lock:
+            return {
+                'delay': round(self.delay, 3),
+                'parallel': self.parallel,
+                'latency': round(self.latency, 3) if self.latency is not None else None,
+                'error_rate': round(self.error_rate, 3),
+            }
+
+
 class ProtonMailScraper:
-    def __init__(self, base_dir="protonmail_data", days_back=30):
+    # Per-step wait timeouts in milliseconds (override with timeouts={...})
+    DEFAULT_TIMEOUTS = {
+        'login_form': 15000,
+        'session_check': 20000,
+        'login_submit': 30000,
+        'two_factor': 120000,
+        'mail_ready': 30000,
+        'folder_idle': 3000,
+        'folder_open': 10000,
+        'list_scroll': 3000,
+        'list_page': 10000,
+        'message_open': 5000,
+        'message_close': 5000,
+        'attachment_start': 15000,
+        'attachment_download': 120000,
+    }
+    # Seconds a download is always given, even when its deadline passed while
+    # the ones started before it were being waited for
+    MIN_DOWNLOAD_WAIT = 5.0
+    
+    def __init__(self, base_dir="protonmail_data", days_back=30, concurrency=1,
+                 timeouts=None, log_waits=True, incremental=False, open_mode='auto',
+                 write_queue_size=100, max_parallel_downloads=3, embed_attachments=False,
+                 reuse_sessions=False, headless=False, block_resources=('image', 'media', 'font'),
+                 block_remote_content=True, viewport=None, folder_workers=1,
+                 storage='eml', compression=None, search_index=True,
+                 login_url="https://account.proton.me/login", mail_url="https://mail.proton.me/u/0/inbox",
+                 metrics='json', trace_messages=False, adaptive_rate=True, target_latency=3.0,
+                 max_retries=3, max_browsers=None):
         self.base_dir = Path(base_dir)
         self.days_back = days_back
+        self.concurrency = concurrency
+        self.timeouts = {**self.DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.log_waits = log_waits
+        self.incremental = incremental
+        # 'pane': read messages in the reading pane, 'back': click + go_back,
+        # 'auto': use the pane whenever the list stays rendered next to the message
+        self.open_mode = open_mode
+        self.write_queue_size = write_queue_size
+        self.max_parallel_downloads = max_parallel_downloads
+        # Also store downloaded attachments as MIME parts inside the .eml
+        self.embed_attachments = embed_attachments
+        # Keep each account's authenticated browser state on disk between runs
+        self.reuse_sessions = reuse_sessions
+        self.sessions_dir = self.base_dir / "sessions"
+        # Browser settings (headless=False lets you handle 2FA/CAPTCHA by hand)
+        self.headless = headless
+        self.block_resources = block_resources
+        self.block_remote_content = block_remote_content
+        self.viewport = viewport
+        # Workers on different folders of the same account at once; every
+        # worker after the first is a browser of its own
+        self.folder_workers = folder_workers
+        # Chromium instances open at once across account and folder workers
+        self.max_browsers = max_browsers or max(concurrency, 1) + max(folder_workers, 1) - 1
+        self._browser_slots = threading.BoundedSemaphore(self.max_browsers)
+        # 'eml': one .eml per message (default), 'cas': deduplicated object store + manifests,
+        # 'mbox': one append-only mbox per folder, 'maildir': one Maildir per folder
+        if storage not in ('eml', 'cas', 'mbox', 'maildir'):
+            raise ValueError(f"Unknown storage: {storage}")
+        self.storage = storage
+        self.content_store = ContentStore(self.base_dir / "objects", compression) if storage == 'cas' else None
+        self.output_backend = None
+        if storage == 'mbox':
+            self.output_backend = MboxBackend(self.base_dir)
+        elif storage == 'maildir':
+            self.output_backend = MaildirBackend(self.base_dir)
+        self.wait_stats = {}
         self.cutoff_date = datetime.now() - timedelta(days=days_back)
+        self.login_url = login_url
+        self.mail_url = mail_url
         self.progress_file = self.base_dir / "progress.json"
         self.completed_file = self.base_dir / "completed_accounts.json"
+        self.index_file = self.base_dir / "archive_index.jsonl"
+        self._archive_index = None
+        # Pacing and download parallelism follow the server's latency and errors;
+        # failures are retried max_retries times, then kept for the next run
+        self.rate = RateController(max_parallel_downloads, target_latency, enabled=adaptive_rate)
+        # page -> list scroll offsets to restore after navigating back from a message
+        self._list_scroll = weakref.WeakKeyDictionary()
+        self.max_retries = max_retries
+        self.retry_file = self.base_dir / "retry_list.json"
+        self._retry_list = None
         self.base_dir.mkdir(exist_ok=True)
+        # Guards progress.json / completed_accounts.json when accounts run concurrently
+        self._state_lock = threading.RLock()
+        self.checkpoints = CheckpointStore(self.base_dir / "checkpoints.db")
+        self.search_index = SearchIndex(self.base_dir / "search.db") if search_index else None
+        # Stage timings and counters; 'json' or 'prometheus' also writes the event log
+        # and a snapshot under metrics/, None keeps them in memory only
+        if metrics not in ('json', 'prometheus', None):
+            raise ValueError(f"Unknown metrics format: {metrics}")
+        self.metrics_format = metrics
+        self.metrics_dir = self.base_dir / "metrics"
+        self.metrics = RunMetrics(
+            self.metrics_dir / "events.jsonl" if metrics else None,
+            self.metrics_dir / "traces.jsonl" if metrics and trace_messages else None
+        )
+        
+    def load_progress(self):
+        """Load scraping progress"""
+        with self._state_lock:
+            if self.progress_file.exists():
+                with open(self.progress_file, 'r') as f:
+                    return json.load(f)
+            return {}
+    
+    def save_progress(self, progress):
+        """Save scraping progress"""
+        with self._state_lock:
+            self._write_json_atomic(self.progress_file, progress)
+    
+    def _write_json_atomic(self, path, data):
+        """Write JSON via a temp file and rename, so a crash never leaves a half-written file"""
+        self._write_text_atomic(path, json.dumps(data, indent=2))
+    
+    def _write_text_atomic(self, path, text):
+        """Write a text file via a temp file and rename"""
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def update_account_progress(self, email, account_progress):
+        """Store one account's progress without clobbering other accounts"""
+        with self._state_lock:
+            progress = self.load_progress()
+            progress[email] = account_progress
+            self.save_progress(progress)
+    
+    def clear_account_progress(self, email):
+        """Drop one account's progress entry"""
+        with self._state_lock:
+            progress = self.load_progress()
+            if email in progress:
+                del progress[email]
+                self.save_progress(progress)
+    
+    def load_completed_accounts(self):
+        """Load list of completed accounts"""
+        with self._state_lock:
+            if self.completed_file.exists():
+                with open(self.completed_file, 'r') as f:
+                    return json.load(f)
+            return []
+    
+    def save_completed_account(self, email):
+        """Mark account as completed"""
+        with self._state_lock:
+            completed = self.load_completed_accounts()
+            if email not in completed:
+                completed.append(email)
+                self._write_json_atomic(self.completed_file, completed)
+    
+    def load_archive_index(self):
+        """Load ids of already archived messages, keyed by (account, folder)"""
+        with self._state_lock:
+            if self._archive_index is None:
+                index = {}
+                if self.index_file.exists():
+                    with open(self.index_file, 'r') as f:
+                        for line in f:
+                            try:
+                                entry = json.loads(line)
+                            except ValueError:
+                                # Tolerate a line cut short by a crash
+                                continue
+                            index.setdefault((entry['account'], entry['folder']), set()).add(entry['id'])
+                self._archive_index = index
+            return self._archive_index
+    
+    def is_archived(self, account_email, folder_name, message_id):
+        """Check whether a message was saved by a previous run"""
+        return message_id in self.load_archive_index().get((account_email, folder_name), ())
+    
+    def record_archived(self, account_email, email_data, path):
+        """Append a saved message to the archive index"""
+        entry = {
+            'account': account_email,
+            'folder': email_data['folder'],
+            'id': email_data['id'],
+            'path': str(path),
+            'archived_at': datetime.now().isoformat()
+        }
+        with self._state_lock:
+            self.load_archive_index().setdefault((account_email, email_data['folder']), set()).add(email_data['id'])
+            with open(self.index_file, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+    
+    def load_retry_list(self):
+        """Messages that kept failing, as {account: {folder: {row key: entry}}}"""
+        with self._state_lock:
+            if self._retry_list is None:
+                self._retry_list = {}
+                if self.retry_file.exists():
+                    with open(self.retry_file, 'r') as f:
+                        self._retry_list = json.load(f)
+            return self._retry_list
+    
+    def pending_retries(self, account_email, folder_name=None):
+        """Row keys waiting for a retry, for one folder or per folder of an account"""
+        with self._state_lock:
+            folders = self.load_retry_list().get(account_email, {})
+            if folder_name is not None:
+                return set(folders.get(folder_name, ()))
+            return {name: set(entries) for name, entries in folders.items()}
+    
+    def add_retry(self, account_email, folder_name, ref, reason, error):
+        """Keep a message that could not be scraped completely for the next run"""
+        with self._state_lock:
+            entries = self.load_retry_list().setdefault(account_email, {}).setdefault(folder_name, {})
+            entry = entries.setdefault(ref['key'], {'runs': 0})
+            entry.update({
+                'element_id': ref.get('element_id'),
+                'subject': (ref.get('subject') or '')[:100],
+                'reason': reason,
+                'error': str(error),
+                'runs': entry['runs'] + 1,
+                'failed_at': datetime.now().isoformat()
+            })
+            self._write_json_atomic(self.retry_file, self._retry_list)
+        self.metrics.count('retry_list_added', account=account_email, folder=folder_name)
+    
+    def resolve_retry(self, account_email, folder_name, row_key):
+        """Drop a message from the retry list once it has been saved"""
+        with self._state_lock:
+            retry_list = self.load_retry_list()
+            entries = retry_list.get(account_email, {}).get(folder_name)
+            if not entries or row_key not in entries:
+                return
+            del entries[row_key]
+            if not entries:
+                del retry_list[account_email][folder_name]
+            if not retry_list[account_email]:
+                del retry_list[account_email]
+            self._write_json_atomic(self.retry_file, retry_list)
+    
+    def wait_for(self, page, step, selector=None, url=None, function=None, arg=None,
+                 network_idle=False, timeout=None):
+        """Wait until the page is ready for a step instead of sleeping
+
+        The given conditions (URL, selector, JS predicate, network idle) are
+        awaited in that order and share the step's timeout. Returns False on
+        timeout rather than raising, and records how long the wait took.
+        """
+        if timeout is None:
+            timeout = self.timeouts.get(step, 10000)
+        start = time.monotonic()
+        
+        def remaining():
+            return max(1, timeout - (time.monotonic() - start) * 1000)
+        
+        ready = True
+        try:
+            if url:
+                page.wait_for_url(url, timeout=remaining())
+            if selector:
+                page.wait_for_selector(selector, timeout=remaining())
+            if function:
+                page.wait_for_function(function, arg=arg, timeout=remaining())
+            if network_idle:
+                page.wait_for_load_state('networkidle', timeout=remaining())
+        except PlaywrightTimeout:
+            ready = False
+        
+        self._record_wait(step, time.monotonic() - start, ready)
+        return ready
+    
+    def _record_wait(self, step, elapsed, ready):
+        """Accumulate wait timings per step"""
+        with self._state_lock:
+            stats = self.wait_stats.setdefault(step, {'count': 0, 'timeouts': 0, 'total': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            if not ready:
+                stats['timeouts'] += 1
+        self.metrics.observe('wait', elapsed, None if ready else "timed out", step=step)
         
-    def load_progress(self):
-        """Load scraping progress"""
-        if self.progress_file.exists():
-            with open(self.progress_file, 'r') as f:
-                return json.load(f)
-        return {}
+        if self.log_waits:
+            status = "ready" if ready else "timed out"
+            print(f"[{datetime.now()}] Wait {step}: {status} after {elapsed:.2f}s")
     
-    def save_progress(self, progress):
-        """Save scraping progress"""
-        with open(self.progress_file, 'w') as f:
-            json.dump(progress, f, indent=2)
+    def print_wait_stats(self):
+        """Print a per-step summary of wait timings for tuning timeouts"""
+        if not self.wait_stats:
+            return
+        print(f"\n{'Step':<16}{'Count':>8}{'Avg (s)':>10}{'Max (s)':>10}{'Timeouts':>10}{'Limit (s)':>11}")
+        for step, stats in sorted(self.wait_stats.items()):
+            avg = stats['total'] / stats['count']
+            limit = self.timeouts.get(step, 10000) / 1000
+            print(f"{step:<16}{stats['count']:>8}{avg:>10.2f}{stats['max']:>10.2f}{stats['timeouts']:>10}{limit:>11.1f}")
     
-    def load_completed_accounts(self):
-        """Load list of completed accounts"""
-        if self.completed_file.exists():
-            with open(self.completed_file, 'r') as f:
-                return json.load(f)
-        return []
+    def print_stage_stats(self):
+        """Print where the run spent its time, per stage"""
+        totals = self.metrics.stage_totals()
+        totals.pop('wait', None)
+        if not totals:
+            return
+        print(f"\n{'Stage':<22}{'Count':>8}{'Total (s)':>11}{'Avg (s)':>10}{'Max (s)':>10}{'Errors':>8}")
+        for stage, stats in sorted(totals.items(), key=lambda item: -item[1]['total']):
+            avg = stats['total'] / stats['count']
+            print(f"{stage:<22}{stats['count']:>8}{stats['total']:>11.2f}{avg:>10.2f}{stats['max']:>10.2f}{stats['errors']:>8}")
     
-    def save_completed_account(self, email):
-        """Mark account as completed"""
-        completed = self.load_completed_accounts()
-        if email not in completed:
-            completed.append(email)
-            with open(self.completed_file, 'w') as f:
-                json.dump(completed, f, indent=2)
+    def write_metrics(self):
+        """Store the metrics snapshot in the configured format; returns its path"""
+        if not self.metrics_format:
+            return None
+        self.metrics_dir.mkdir(parents=True, exist_ok=True)
+        if self.metrics_format == 'prometheus':
+            path = self.metrics_dir / "metrics.prom"
+            self._write_text_atomic(path, self.metrics.prometheus())
+        else:
+            path = self.metrics_dir / "metrics.json"
+            self._write_json_atomic(path, self.metrics.snapshot())
+        return path
     
     def login(self, page, email, password):
         """Login to ProtonMail"""
         print(f"[{datetime.now()}] Logging in as {email}...")
         
         # Navigate to ProtonMail
-        page.goto("https://account.proton.me/login", wait_until="networkidle")
-        time.sleep(2)
+        page.goto(self.login_url, wait_until="domcontentloaded")
+        self.wait_for(page, 'login_form', selector='input[name="username"]')
         
         # Enter username
         page.fill('input[name="username"]', email)
@@ -63,27 +1912,58 @@ class ProtonMailScraper:
         
         # Wait for potential 2FA or CAPTCHA
         print("Waiting for login to complete (handle 2FA/CAPTCHA if needed)...")
-        time.sleep(5)
+        two_factor_selector = 'input[type="text"][placeholder*="code"]'
+        self.wait_for(
+            page, 'login_submit',
+            function="""sel => location.href.toLowerCase().includes('two-factor')
+                || location.href.includes('/mail')
+                || document.querySelector(sel) !== null""",
+            arg=f'[data-testid="navigation-link:inbox"], {two_factor_selector}'
+        )
         
         # Check if we need to handle 2FA
-        if "two-factor" in page.url.lower() or page.locator('input[type="text"][placeholder*="code"]').count() > 0:
+        if "two-factor" in page.url.lower() or page.locator(two_factor_selector).count() > 0:
             print("\n⚠️  2FA REQUIRED - Please enter your 2FA code in the browser")
-            print("Waiting 60 seconds for you to complete 2FA...")
-            time.sleep(60)
+            print(f"Waiting up to {self.timeouts['two_factor'] // 1000} seconds for you to complete 2FA...")
+            self.wait_for(page, 'two_factor', selector='[data-testid="navigation-link:inbox"]')
         
         # Wait for mail interface to load
-        try:
-            page.wait_for_url("**/mail/**", timeout=30000)
+        if self.wait_for(page, 'mail_ready', selector='[data-testid="navigation-link:inbox"]'):
             print(f"[{datetime.now()}] Login successful!")
-            time.sleep(3)
             return True
-        except PlaywrightTimeout:
-            # Try alternative: check if we're already in mail
-            if "/mail" in page.url or page.locator('[data-testid="navigation-link:inbox"]').count() > 0:
-                print(f"[{datetime.now()}] Login successful!")
-                return True
-            print(f"[{datetime.now()}] Login failed or timed out")
-            return False
+        
+        # Try alternative: check if we're already in mail
+        if "/mail" in page.url or page.locator('[data-testid="navigation-link:inbox"]').count() > 0:
+            print(f"[{datetime.now()}] Login successful!")
+            return True
+        print(f"[{datetime.now()}] Login failed or timed out")
+        return False
+    
+    def session_file(self, email):
+        """Path of the saved browser state for an account"""
+        return self.sessions_dir / f"{email.replace('@', '_at_')}.json"
+    
+    def save_session(self, context, email):
+        """Save the account's cookies and local storage for the next run"""
+        self.sessions_dir.mkdir(exist_ok=True)
+        session_file = self.session_file(email)
+        try:
+            context.storage_state(path=str(session_file))
+            # The file holds live auth tokens
+            os.chmod(session_file, 0o600)
+            print(f"[{datetime.now()}] Session saved for {email}")
+        except Exception as e:
+            print(f"[{datetime.now()}] Could not save session for {email}: {e}")
+    
+    def restore_session(self, page, email):
+        """Open the mailbox with a saved session; False if it has expired"""
+        print(f"[{datetime.now()}] Reusing saved session for {email}...")
+        page.goto(self.mail_url, wait_until="domcontentloaded")
+        if self.wait_for(page, 'session_check', selector='[data-testid="navigation-link:inbox"]'):
+            print(f"[{datetime.now()}] Session still valid, skipping login")
+            return True
+        print(f"[{datetime.now()}] Saved session expired, logging in again")
+        return False
     
     def get_folders(self, page):
         """Get list of mail folders"""
@@ -126,179 +2006,385 @@ class ProtonMailScraper:
         return folders
     
     def navigate_to_folder(self, page, folder):
-        """Navigate to a specific folder"""
+        """Navigate to a specific folder
+
+        The rows shown before the click are marked, and the list only counts
+        as switched once they are gone or replaced, so the previous folder's
+        rows are never read under this folder's name. A link the app already
+        marks as the current page needs no switch.
+        """
         print(f"[{datetime.now()}] Opening folder: {folder['name']}")
         
+        marked = page.evaluate(MARK_LIST_JS)
         try:
             page.click(folder['selector'])
-            time.sleep(2)
-            
-            # Wait for email list to load
-            page.wait_for_selector('[data-testid="message-item"]', timeout=10000)
-            return True
         except PlaywrightTimeout:
+            print(f"[{datetime.now()}] Folder link not clickable: {folder['name']}")
+            return False
+        
+        if not self.wait_for(page, 'folder_open', function=FOLDER_CHANGED_JS, arg=marked):
+            if page.locator(folder['selector']).first.get_attribute('aria-current') != 'page':
+                print(f"[{datetime.now()}] Message list did not switch to {folder['name']}")
+                return False
+        
+        # Let the folder request settle, then wait for email list to load
+        self.wait_for(page, 'folder_idle', network_idle=True)
+        if not self.wait_for(page, 'folder_open', selector='[data-testid="message-item"]'):
             print(f"[{datetime.now()}] No emails in folder or timeout")
             return False
+        return True
     
     def parse_date(self, date_str):
-        """Parse date from various formats"""
-        try:
-            # Try common formats
-            for fmt in ["%b %d, %Y", "%d %b %Y", "%Y-%m-%d", "%m/%d/%Y"]:
-                try:
-                    return datetime.strptime(date_str, fmt)
-                except:
-                    continue
-            
-            # Handle relative dates like "Today", "Yesterday"
-            if "today" in date_str.lower():
-                return datetime.now()
-            elif "yesterday" in date_str.lower():
-                return datetime.now() - timedelta(days=1)
-            
-            return None
-        except:
+        """Parse date from the header or list formats (memoized)"""
+        if not date_str:
             return None
+        return _parse_date_cached(date_str, date.today())
+    
+    def extract_message(self, page):
+        """Extract all fields of the open message with one page.evaluate call"""
+        data = page.evaluate(EXTRACT_MESSAGE_JS)
+        date_str = data['date'] or ""
+        email_date = self.parse_date(date_str) if date_str else None
+        return {
+            'subject': data['subject'] or "No Subject",
+            'from': data['from'] or "Unknown",
+            'date': date_str,
+            'date_parsed': email_date,
+            'body': MessageBody(data['body_html'], data['inline_images']),
+            'attachments': data['attachments'],
+        }
+    
+    def extract_list_rows(self, page):
+        """Extract metadata for every rendered message-item row with one page.evaluate call"""
+        try:
+            return page.evaluate(EXTRACT_LIST_ROWS_JS)
+        except Exception as e:
+            print(f"[{datetime.now()}] Could not read message list: {e}")
+            return []
+    
+    def message_id(self, message, element_id=None):
+        """Build a stable message id
+
+        Prefers the app's own message/conversation id; otherwise hashes the
+        headers so the id survives new mail shifting list positions.
+        """
+        if element_id:
+            return re.sub(r'[^A-Za-z0-9_=-]', '_', element_id)
+        headers = f"{message['from']}\n{message['date']}\n{message['subject']}"
+        return "h" + hashlib.sha1(headers.encode('utf-8')).hexdigest()[:16]
+    
+    def _id_from_url(self, url):
+        """Read the conversation/message id the app puts in the URL of an open message
+
+        The id is the last path segment: on label folders the label id comes
+        first (/u/0/<labelID>/<conversationID>).
+        """
+        segments = [segment for segment in urlparse(url).path.split('/') if segment]
+        if segments and re.fullmatch(r'[A-Za-z0-9_=-]{20,}', segments[-1]):
+            return segments[-1]
+        return None
     
     def get_emails_in_folder(self, page, folder, account_email):
-        """Get all emails in a folder"""
+        """Get all emails in a folder as a list"""
+        return list(self.iter_emails_in_folder(page, folder, account_email))
+    
+    def iter_emails_in_folder(self, page, folder, account_email):
+        """Yield the emails of a folder one at a time
+
+        The list is harvested as it scrolls, so rows are opened while they are
+        rendered. Whether the folder was fully covered is stored in
+        folder['coverage'] once the generator is exhausted.
+
+        A message that fails is retried after a jittered backoff, between the
+        following rows; after max_retries it goes to the retry list for the
+        next run. With folder['retry_only'] only messages on that list are
+        opened.
+        """
         print(f"[{datetime.now()}] Fetching emails from {folder['name']}...")
         
-        emails = []
         processed_ids = set()
+        skipped = 0
+        harvester = MessageListHarvester(self, page, folder)
+        in_place = {'pane': True, 'back': False}.get(self.open_mode)
         
-        # Scroll to load all emails
-        last_count = 0
-        scroll_attempts = 0
-        max_scrolls = 50
+        # Messages saved before an interrupted run are skipped without opening them
+        saved_ids, saved_keys = self.checkpoints.saved_messages(account_email, folder['name'])
+        resumed = 0
+        if saved_ids:
+            print(f"[{datetime.now()}] Resuming {folder['name']}: {len(saved_ids)} emails already saved")
         
-        while scroll_attempts < max_scrolls:
-            # Get current email items
-            email_items = page.locator('[data-testid="message-item"]').all()
-            current_count = len(email_items)
-            
-            if current_count == last_count:
-                scroll_attempts += 1
-                if scroll_attempts >= 3:
-                    break
-            else:
-                scroll_attempts = 0
-            
-            last_count = current_count
-            
-            # Scroll down
-            if email_items:
-                email_items[-1].scroll_into_view_if_needed()
-                time.sleep(1)
+        # Messages that failed in an earlier run are opened again even if saved
+        retry_keys = self.pending_retries(account_email, folder['name'])
+        retry_only = folder.get('retry_only', False)
+        seen_retry_keys = set()
         
-        print(f"[{datetime.now()}] Found {current_count} emails, processing...")
+        # Failed rows wait in a heap ordered by when their backoff ends
+        attempts = {}
+        retry_queue = []
+        cutoff_reached = []
         
-        # Process each email
-        email_items = page.locator('[data-testid="message-item"]').all()
+        def refs():
+            for ref in harvester:
+                yield ref
+                while retry_queue and retry_queue[0][0] <= time.monotonic():
+                    yield heapq.heappop(retry_queue)[2]
+                if cutoff_reached:
+                    break
+            # Rows still backing off are newer than the cutoff, so drain them
+            while retry_queue:
+                due, _, ref = heapq.heappop(retry_queue)
+                time.sleep(max(0.0, due - time.monotonic()))
+                yield ref
         
-        for idx, item in enumerate(email_items):
+        labels = {'account': account_email, 'folder': folder['name']}
+        for ref in refs():
+            idx = ref['position']
+            spans = {}
+            started = time.perf_counter()
+            retrying = ref['key'] in retry_keys
+            if retrying:
+                seen_retry_keys.add(ref['key'])
             try:
-                # Get email ID (use index as fallback)
-                email_id = f"{folder['name']}_{idx}"
+                # Use the app's id from the list row when it exposes one
+                email_id = self.message_id(None, ref['element_id']) if ref.get('element_id') else None
                 
-                if email_id in processed_ids:
+                if retry_only and not retrying:
+                    continue
+                if not retrying and (ref['key'] in saved_keys or (email_id and email_id in saved_ids)):
+                    resumed += 1
+                    continue
+                if email_id and email_id in processed_ids:
+                    continue
+                if email_id and not retrying and self.incremental and self.is_archived(account_email, folder['name'], email_id):
+                    skipped += 1
                     continue
                 
-                # Click to open email
-                item.click()
-                time.sleep(1.5)
-                
-                # Wait for email content to load
-                page.wait_for_selector('[data-testid="message-content"]', timeout=5000)
+                # Open email and wait for its content to load
+                self.rate.pace()
+                with self.metrics.timer('open_message', spans):
+                    self.open_message(page, ref, harvester.positions, keep_scroll=in_place is not True)
+                if in_place is None:
+                    in_place = page.locator('[data-testid="message-item"]').count() > 0
+                    print(f"[{datetime.now()}] Reading {folder['name']} {'in the reading pane' if in_place else 'with back navigation'}")
                 
                 # Extract email details
-                subject = "No Subject"
-                try:
-                    subject_elem = page.locator('[data-testid="message-header-subject"]').first
-                    if subject_elem.count() > 0:
-                        subject = subject_elem.inner_text().strip()
-                except:
-                    pass
-                
-                # Get sender
-                sender = "Unknown"
-                try:
-                    sender_elem = page.locator('[data-testid="message-header-from"]').first
-                    if sender_elem.count() > 0:
-                        sender = sender_elem.inner_text().strip()
-                except:
-                    pass
-                
-                # Get date
-                date_str = ""
-                email_date = None
-                try:
-                    date_elem = page.locator('[data-testid="message-header-date"]').first
-                    if date_elem.count() > 0:
-                        date_str = date_elem.inner_text().strip()
-                        email_date = self.parse_date(date_str)
-                except:
-                    pass
+                with self.metrics.timer('extract_message', spans):
+                    message = self.extract_message(page)
+                self._record_rate(spans['open_message'] + spans['extract_message'])
+                subject = message['subject']
+                email_date = message['date_parsed']
+                email_id = self.message_id(message, email_id or self._id_from_url(page.url))
                 
                 # Check if email is within date range
                 if email_date and email_date < self.cutoff_date:
-                    print(f"[{datetime.now()}] Email too old, stopping: {subject[:50]}")
-                    break
-                
-                # Get email body
-                body_html = ""
-                body_text = ""
-                try:
-                    body_elem = page.locator('[data-testid="message-content"]').first
-                    if body_elem.count() > 0:
-                        body_html = body_elem.inner_html()
-                        body_text = body_elem.inner_text()
-                except:
-                    pass
+                    if not cutoff_reached:
+                        print(f"[{datetime.now()}] Email too old, stopping: {subject[:50]}")
+                        harvester._finish(True, "reached cutoff in message header")
+                        cutoff_reached.append(True)
+                    self.close_message(page, in_place)
+                    continue
                 
-                # Get attachments
-                attachments = []
-                try:
-                    attachment_elems = page.locator('[data-testid^="attachment-"]').all()
-                    for att_elem in attachment_elems:
-                        att_name = att_elem.inner_text().strip()
-                        if att_name:
-                            attachments.append(att_name)
-                except:
-                    pass
+                if email_id in saved_ids and not retrying:
+                    resumed += 1
+                    self.close_message(page, in_place)
+                    continue
+                if email_id in processed_ids or (not retrying and self.incremental and self.is_archived(account_email, folder['name'], email_id)):
+                    skipped += 1
+                    self.close_message(page, in_place)
+                    continue
                 
                 email_data = {
                     'id': email_id,
                     'subject': subject,
-                    'from': sender,
-                    'date': date_str,
+                    'from': message['from'],
+                    'date': message['date'],
                     'date_parsed': email_date.isoformat() if email_date else None,
-                    'body_html': body_html,
-                    'body_text': body_text,
-                    'attachments': attachments,
-                    'folder': folder['name']
+                    'body': message['body'],
+                    'attachments': message['attachments'],
+                    'attachment_files': [],
+                    'failed_attachments': [],
+                    'folder': folder['name'],
+                    'row_key': ref['key'],
+                    'element_id': ref.get('element_id')
                 }
                 
-                emails.append(email_data)
+                # Download attachments while the message is open
+                if email_data['attachments']:
+                    with self.metrics.timer('download_attachments', spans):
+                        email_data['attachment_files'] = self.download_attachments(page, email_data, account_email)
+                    self.metrics.count('attachments_downloaded', len(email_data['attachment_files']), **labels)
+                    self.metrics.count('attachments_failed', len(email_data['failed_attachments']), **labels)
+                    if email_data['failed_attachments']:
+                        # Saved without them now; the next run opens the message again
+                        self.add_retry(account_email, folder['name'], ref, 'attachments',
+                                       f"not downloaded: {', '.join(email_data['failed_attachments'])}")
+                
                 processed_ids.add(email_id)
+                self.metrics.observe('message', time.perf_counter() - started, **labels)
+                email_data['timings'] = spans
                 
-                print(f"[{datetime.now()}] [{idx+1}/{current_count}] {subject[:50]}")
+                print(f"[{datetime.now()}] [{idx}] {subject[:50]}")
+                yield email_data
                 
-                # Go back to list
-                page.go_back()
-                time.sleep(1)
+                # Go back to list (no-op when reading in place)
+                with self.metrics.timer('close_message'):
+                    self.close_message(page, in_place)
                 
             except Exception as e:
                 print(f"[{datetime.now()}] Error processing email {idx}: {e}")
+                self.metrics.count('message_errors', **labels)
+                self.metrics.event('error', stage='message', position=idx, row=ref['key'], error=str(e), **labels)
+                if not isinstance(e, RowNotReachable):
+                    self._record_rate(time.perf_counter() - started, ok=False)
                 # Try to go back to list
                 try:
-                    page.go_back()
-                    time.sleep(1)
+                    if page.locator('[data-testid="message-item"]').count() == 0:
+                        self.close_message(page, False)
                 except:
                     pass
+                
+                attempt = attempts[ref['key']] = attempts.get(ref['key'], 0) + 1
+                if isinstance(e, RowNotReachable):
+                    # Scrolling after it again could only lose other rows; next run finds it afresh
+                    self.add_retry(account_email, folder['name'], ref, 'unreachable', e)
+                    print(f"[{datetime.now()}] ⚠️  Email {idx} cannot be reached in the list any more, kept in {self.retry_file.name}")
+                elif attempt <= self.max_retries:
+                    delay = self.rate.backoff(attempt)
+                    heapq.heappush(retry_queue, (time.monotonic() + delay, idx, ref))
+                    self.metrics.count('retries', stage='message', **labels)
+                    print(f"[{datetime.now()}] Retrying email {idx} in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries + 1})")
+                else:
+                    self.add_retry(account_email, folder['name'], ref, 'message', e)
+                    print(f"[{datetime.now()}] ⚠️  Giving up on email {idx} for this run, kept in {self.retry_file.name}")
                 continue
         
-        return emails
+        folder['coverage'] = {
+            'complete': harvester.complete,
+            'rows_seen': harvester.count,
+            'reason': harvester.stop_reason
+        }
+        self.metrics.count('messages_listed', harvester.count, **labels)
+        self.metrics.count('messages_resumed', resumed, **labels)
+        self.metrics.count('messages_skipped', skipped, **labels)
+        self.metrics.event('folder_listed', complete=harvester.complete, rows=harvester.count, reason=harvester.stop_reason, **labels)
+        
+        # Retry entries whose rows are gone (deleted, moved, or now past the cutoff)
+        if harvester.complete:
+            for key in retry_keys - seen_retry_keys:
+                self.resolve_retry(account_email, folder['name'], key)
+                print(f"[{datetime.now()}] Dropped retry entry no longer in {folder['name']}: {key}")
+        print(f"[{datetime.now()}] Listed {harvester.count} emails in {folder['name']} ({harvester.stop_reason or 'stopped early'})")
+        if not harvester.complete:
+            print(f"[{datetime.now()}] ⚠️  {folder['name']} was not fully covered")
+        if resumed:
+            print(f"[{datetime.now()}] Skipped {resumed} emails saved before the last interruption")
+        if skipped:
+            print(f"[{datetime.now()}] Skipped {skipped} already archived emails in {folder['name']}")
+    
+    def _record_rate(self, latency, ok=True):
+        """Feed the rate controller and log when it slows down or changes parallelism"""
+        delay, parallel = self.rate.delay, self.rate.parallel
+        if self.rate.record(latency, ok):
+            state = self.rate.state()
+            self.metrics.event('rate', **state)
+            if state['delay'] > delay or state['parallel'] != parallel:
+                print(f"[{datetime.now()}] Pacing now {state['delay']:.2f}s between messages, "
+                      f"{state['parallel']} parallel downloads (latency {state['latency']:.2f}s)")
+    
+    def open_message(self, page, ref, positions=None, keep_scroll=False):
+        """Click a list row and wait until its message replaced the one shown before
+
+        With keep_scroll the list's scroll offsets are remembered, so
+        close_message can put the list back where it was after navigating
+        back. Raises RowNotReachable when the row cannot be rendered again.
+        """
+        previous = page.evaluate(MARK_OPEN_MESSAGE_JS)
+        if not self.scroll_to_row(page, ref, positions):
+            raise RowNotReachable("Row is no longer in the message list")
+        if keep_scroll:
+            self._list_scroll[page] = page.evaluate(LIST_SCROLL_JS, None)
+        self.locate_row(page, ref).click()
+        if not self.wait_for(page, 'message_open', function=MESSAGE_CHANGED_JS, arg=previous):
+            raise PlaywrightTimeout("Message content did not load")
+    
+    def close_message(self, page, in_place):
+        """Return to the message list unless the message was read in place"""
+        if in_place:
+            return
+        page.go_back()
+        if self.wait_for(page, 'message_close', selector='[data-testid="message-item"]'):
+            scroll = self._list_scroll.pop(page, None)
+            if scroll:
+                page.evaluate(LIST_SCROLL_JS, scroll)
+    
+    def scroll_to_row(self, page, ref, positions=None, max_steps=2000):
+        """Make sure a harvested row is rendered, scrolling the list if needed
+
+        A retried row may have scrolled out of a virtualized list, and apps
+        that re-render the list from the top after back navigation drop rows
+        harvested further down. The list is scrolled towards the row, up or
+        down depending on where the rendered rows sit in `positions` (the
+        harvester's key -> position map), and never past it, so no unread
+        row is skipped on the way. False when the row cannot be reached.
+        """
+        row = self.locate_row(page, ref)
+        target = ref.get('position')
+        for _ in range(max_steps):
+            if row.count():
+                return True
+            rows = self.extract_list_rows(page)
+            if not rows or not positions or target is None:
+                return False
+            known = [positions[key] for key, _ in MessageListHarvester.row_keys(rows) if key in positions]
+            if not known:
+                return False
+            if target < min(known):
+                edge, signature = 'first', MessageListHarvester._signature(rows[0])
+                page.evaluate(SCROLL_LIST_JS, 'up')
+            elif target > max(known):
+                edge, signature = 'last', MessageListHarvester._signature(rows[-1])
+                page.evaluate(SCROLL_LIST_JS, 'down')
+            else:
+                # Within the rendered window: either it rendered since the
+                # check above (a load was still in flight) or it is gone
+                return row.count() > 0
+            if not self.wait_for(page, 'list_scroll', function=LIST_CHANGED_JS, arg=[edge, signature]):
+                return False
+        return row.count() > 0
+    
+    def locate_row(self, page, ref):
+        """Locator for a harvested list row, by app id or by its text
+
+        Of several rows with the same text, the one at the ref's occurrence.
+        """
+        if ref.get('element_id'):
+            return page.locator(f'[data-testid="message-item"][data-element-id="{ref["element_id"]}"]').first
+        first_line = (ref.get('text') or '').split('\n')[0]
+        matches = page.locator('[data-testid="message-item"]').filter(has_text=first_line)
+        return matches.nth(ref.get('occurrence', 1) - 1)
+    
+    def save_email(self, email_data, account_email, on_durable=None):
+        """Save email with the configured storage and return where it went
+
+        on_durable(path) is called once the message is actually on disk:
+        right away for .eml, the content store and Maildir, after the next
+        batch fsync for mbox.
+        """
+        if self.output_backend is not None:
+            msg = self.build_email_message(email_data, self.embed_attachments)
+            return self.output_backend.save(msg, account_email.replace('@', '_at_'), email_data['folder'], on_durable)
+        if self.storage == 'cas':
+            path = self.save_email_to_store(email_data, account_email)
+        else:
+            path = self.save_email_as_eml(email_data, account_email)
+        if on_durable is not None:
+            on_durable(path)
+        return path
+    
+    def flush_storage(self):
+        """Push buffered bulk-backend writes to disk"""
+        if self.output_backend is not None:
+            self.output_backend.flush()
     
     def save_email_as_eml(self, email_data, account_email):
         """Save email as .eml file"""
@@ -312,27 +2398,229 @@ class ProtonMailScraper:
         filename = f"{email_data['id']}_{safe_subject}.eml"
         filepath = folder_dir / filename
         
-        # Build email message
+        msg = self.build_email_message(email_data, self.embed_attachments)
+        
+        # Encode straight into the file instead of building the whole message in memory
+        with open(filepath, 'wb') as f:
+            BytesGenerator(f, mangle_from_=False, policy=msg.policy).flatten(msg)
+        
+        return filepath
+    
+    def save_email_to_store(self, email_data, account_email):
+        """Save email into the content-addressed store
+
+        The message (without attachments) and each attachment are stored
+        once by hash; the folder membership goes to the account manifest.
+        """
+        message_hash = self.content_store.put_bytes(self.build_email_message(email_data, False).as_bytes())
+        
+        attachments = []
+        for att_path in email_data.get('attachment_files', []):
+            att_path = Path(att_path)
+            size = att_path.stat().st_size
+            attachments.append({
+                'name': att_path.name,
+                'hash': self.content_store.put_file(att_path, remove=True),
+                'size': size
+            })
+        if attachments:
+            # The download directory is empty once its files are in the store
+            try:
+                Path(email_data['attachment_files'][0]).parent.rmdir()
+            except OSError:
+                pass
+        
+        entry = {
+            'id': email_data['id'],
+            'folder': email_data['folder'],
+            'subject': email_data['subject'],
+            'from': email_data['from'],
+            'date': email_data['date'],
+            'message': message_hash,
+            'attachments': attachments,
+            'saved_at': datetime.now().isoformat()
+        }
+        manifest = self.manifest_file(account_email)
+        with self._state_lock:
+            manifest.parent.mkdir(parents=True, exist_ok=True)
+            with open(manifest, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+        
+        return self.content_store.object_path(message_hash)
+    
+    def index_email(self, account_email, email_data, path):
+        """Add a saved email to the search index"""
+        if self.search_index is None:
+            return
+        self.search_index.add(
+            account_email, email_data['folder'], email_data['id'], path,
+            email_data['subject'], email_data['from'], email_data['date'],
+            email_data['body'].text, email_data['attachments']
+        )
+    
+    def search(self, query, account_email=None, folder_name=None, limit=50):
+        """Search the saved archive; see SearchIndex.search"""
+        if self.search_index is None:
+            self.search_index = SearchIndex(self.base_dir / "search.db")
+        return self.search_index.search(query, account_email, folder_name, limit)
+    
+    def rebuild_search_index(self):
+        """Rebuild the search index from everything saved under base_dir
+
+        Reads .eml folders, mbox files, Maildirs and content-store manifests.
+        """
+        if self.search_index is None:
+            self.search_index = SearchIndex(self.base_dir / "search.db")
+        self.search_index.clear()
+        
+        # Message ids of saved files, where the archive index knows them
+        ids_by_path = {}
+        if self.index_file.exists():
+            with open(self.index_file, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    ids_by_path[entry['path']] = entry['id']
+        
+        store = self.content_store or ContentStore(self.base_dir / "objects")
+        parser = BytesParser(policy=policy.default)
+        count = 0
+        
+        for account_dir in sorted(p for p in self.base_dir.iterdir() if p.is_dir() and '_at_' in p.name):
+            account_email = account_dir.name.replace('_at_', '@')
+            
+            # One .eml per message
+            for eml_path in sorted(account_dir.glob('*/*.eml')):
+                message_id = ids_by_path.get(str(eml_path), eml_path.stem)
+                attachments_dir = eml_path.parent / f"{message_id}_attachments"
+                extra = [p.name for p in attachments_dir.iterdir()] if attachments_dir.is_dir() else []
+                with open(eml_path, 'rb') as f:
+                    msg = parser.parse(f)
+                self._index_parsed_message(account_email, eml_path.parent.name, message_id, eml_path, msg, extra)
+                count += 1
+            
+            # mbox files
+            for mbox_path in sorted(account_dir.glob('*.mbox')):
+                for msg in mailbox.mbox(str(mbox_path), factory=lambda f: parser.parse(f), create=False):
+                    self._index_parsed_message(account_email, mbox_path.stem, None, mbox_path, msg)
+                    count += 1
+            
+            # Maildirs
+            maildir_root = account_dir / "maildir"
+            if maildir_root.is_dir():
+                for box_dir in sorted(p for p in maildir_root.iterdir() if p.is_dir()):
+                    for msg_path in sorted(list((box_dir / "cur").glob('*')) + list((box_dir / "new").glob('*'))):
+                        with open(msg_path, 'rb') as f:
+                            msg = parser.parse(f)
+                        self._index_parsed_message(account_email, box_dir.name, msg_path.name.split(':')[0], msg_path, msg)
+                        count += 1
+            
+            # Content store manifests
+            for (folder_name, message_id), entry in self.load_manifest(account_email).items():
+                try:
+                    msg = parser.parsebytes(store.get(entry['message']))
+                except FileNotFoundError:
+                    continue
+                extra = [att['name'] for att in entry['attachments']]
+                self._index_parsed_message(account_email, folder_name, message_id, store.object_path(entry['message']), msg, extra)
+                count += 1
+        
+        self.search_index.flush()
+        print(f"[{datetime.now()}] Indexed {count} messages")
+        return count
+    
+    def _index_parsed_message(self, account_email, folder_name, message_id, path, msg, extra_attachments=()):
+        """Index a message read back from disk"""
+        subject = str(msg['Subject'] or '')
+        sender = str(msg['From'] or '')
+        date_str = str(msg['Date'] or '')
+        if message_id is None:
+            message_id = self.message_id({'from': sender, 'date': date_str, 'subject': subject})
+        
+        body = ''
+        part = msg.get_body(preferencelist=('plain', 'html'))
+        if part is not None:
+            try:
+                body = part.get_content()
+            except (LookupError, UnicodeDecodeError):
+                body = part.get_payload(decode=True).decode('utf-8', 'replace')
+            if part.get_content_subtype() == 'html':
+                body = html_to_text(body)
+        
+        attachments = [a.get_filename() for a in msg.iter_attachments() if a.get_filename()]
+        attachments.extend(name for name in extra_attachments if name not in attachments)
+        self.search_index.add(account_email, folder_name, message_id, path, subject, sender, date_str, body, attachments)
+    
+    def manifest_file(self, account_email):
+        """Path of an account's folder/label manifest"""
+        return self.base_dir / account_email.replace('@', '_at_') / "manifest.jsonl"
+    
+    def load_manifest(self, account_email):
+        """Read an account's manifest; the latest entry per (folder, id) wins"""
+        entries = {}
+        manifest = self.manifest_file(account_email)
+        if manifest.exists():
+            with open(manifest, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    entries[(entry['folder'], entry['id'])] = entry
+        return entries
+    
+    def build_email_message(self, email_data, embed_attachments=False):
+        """Build the EmailMessage for an extracted email"""
         msg = email.message.EmailMessage()
         msg['Subject'] = email_data['subject']
         msg['From'] = email_data['from']
         msg['Date'] = email_data['date']
         
-        # Set body
-        if email_data['body_html']:
-            msg.set_content(email_data['body_text'])
-            msg.add_alternative(email_data['body_html'], subtype='html')
+        # Set body: plain text derived from the HTML, and the HTML with its
+        # inline images as related parts
+        body = email_data['body']
+        if body.html:
+            msg.set_content(body.text)
+            msg.add_alternative(body.html, subtype='html')
+            html_part = msg.get_payload()[1]
+            for cid, (maintype, subtype, data) in body.images.items():
+                html_part.add_related(data, maintype=maintype, subtype=subtype, cid=f"<{cid}>", disposition='inline')
         else:
-            msg.set_content(email_data['body_text'])
+            msg.set_content(body.text)
         
-        # Save to file
-        with open(filepath, 'wb') as f:
-            f.write(msg.as_bytes())
+        # Embed downloaded attachments
+        if embed_attachments:
+            for att_path in email_data.get('attachment_files', []):
+                att_path = Path(att_path)
+                ctype, encoding = mimetypes.guess_type(att_path.name)
+                if ctype is None or encoding is not None:
+                    ctype = 'application/octet-stream'
+                maintype, subtype = ctype.split('/', 1)
+                msg.add_attachment(att_path.read_bytes(), maintype=maintype, subtype=subtype, filename=att_path.name)
         
-        return filepath
+        # Derive MIME boundaries from the content so the same email always
+        # serializes to the same bytes (and hashes the same in the store)
+        if msg.is_multipart():
+            seed = hashlib.sha1("\0".join([body.html, *body.images]).encode('utf-8')).hexdigest()[:24]
+            for n, part in enumerate(p for p in msg.walk() if p.is_multipart()):
+                part.set_boundary(f"===============_{seed}_{n}==")
+        
+        return msg
     
     def download_attachments(self, page, email_data, account_email):
-        """Download email attachments"""
+        """Download the attachments of the open message
+
+        Download buttons are clicked while the message is still open and up
+        to max_parallel_downloads transfers (fewer while the rate controller
+        is backing off) run in the browser at once. Each download must start
+        within the 'attachment_start' timeout and finish within
+        'attachment_download' of being started, or it is cancelled. Failed
+        downloads are retried
+        after a jittered backoff; names that still fail are left in
+        email_data['failed_attachments'].
+        """
         if not email_data['attachments']:
             return []
         
@@ -343,170 +2631,610 @@ class ProtonMailScraper:
         attachments_dir.mkdir(parents=True, exist_ok=True)
         
         downloaded = []
+        pending = deque()
+        failed = []
+        names = []
+        used_names = set()
         
         print(f"[{datetime.now()}] Downloading {len(email_data['attachments'])} attachments...")
         
-        # Note: Actual attachment download requires clicking download buttons
-        # This is a simplified version - full implementation would need to handle
-        # the download dialog and file system operations
+        def finish_oldest():
+            idx, download, started = pending.popleft()
+            att_name = names[idx]
+            try:
+                deadline = started + self.timeouts['attachment_download'] / 1000
+                failure = self._wait_for_download(download, deadline)
+                if failure:
+                    raise RuntimeError(failure)
+                filepath = attachments_dir / att_name
+                download.save_as(filepath)
+                downloaded.append(str(filepath))
+                elapsed = time.monotonic() - started
+                self._record_wait('attachment', elapsed, True)
+                self._record_rate(elapsed)
+                print(f"[{datetime.now()}] Downloaded: {att_name}")
+            except Exception as e:
+                self._record_rate(time.monotonic() - started, ok=False)
+                failed.append(idx)
+                print(f"[{datetime.now()}] Failed to download attachment {att_name}: {e}")
+        
+        def start(idx):
+            download_btn = attachment_elems.nth(idx).locator('button[title*="Download"]').first
+            if download_btn.count() == 0:
+                failed.append(idx)
+                print(f"[{datetime.now()}] No download button for: {names[idx]}")
+                return
+            
+            # Keep the number of transfers in flight bounded
+            while len(pending) >= self.rate.parallel:
+                finish_oldest()
+            
+            started = time.monotonic()
+            try:
+                with page.expect_download(timeout=self.timeouts['attachment_start']) as download_info:
+                    download_btn.click()
+                pending.append((idx, download_info.value, started))
+            except PlaywrightTimeout:
+                self._record_wait('attachment', time.monotonic() - started, False)
+                self._record_rate(time.monotonic() - started, ok=False)
+                failed.append(idx)
+                print(f"[{datetime.now()}] Download did not start: {names[idx]}")
         
         try:
-            attachment_elems = page.locator('[data-testid^="attachment-"]').all()
+            attachment_elems = page.locator('[data-testid^="attachment-"]')
             
-            for idx, att_elem in enumerate(attachment_elems):
-                try:
-                    # Get attachment name
-                    att_name = email_data['attachments'][idx] if idx < len(email_data['attachments']) else f"attachment_{idx}"
-                    
-                    # Setup download handler
-                    with page.expect_download() as download_info:
-                        # Click download button
-                        download_btn = att_elem.locator('button[title*="Download"]').first
-                        if download_btn.count() > 0:
-                            download_btn.click()
-                    
-                    download = download_info.value
-                    
-                    # Save file
-                    filepath = attachments_dir / att_name
-                    download.save_as(filepath)
-                    downloaded.append(str(filepath))
-                    
-                    print(f"[{datetime.now()}] Downloaded: {att_name}")
-                    
-                except Exception as e:
-                    print(f"[{datetime.now()}] Failed to download attachment: {e}")
-                    continue
+            for idx in range(attachment_elems.count()):
+                # Get attachment name (unique within the message)
+                att_name = email_data['attachments'][idx] if idx < len(email_data['attachments']) else f"attachment_{idx}"
+                att_name = re.sub(r'[<>:"/\\|?*]', '_', att_name) or f"attachment_{idx}"
+                if att_name in used_names:
+                    att_name = f"{idx}_{att_name}"
+                used_names.add(att_name)
+                names.append(att_name)
+            
+            for idx in range(len(names)):
+                start(idx)
+            while pending:
+                finish_oldest()
+            
+            for attempt in range(1, self.max_retries + 1):
+                if not failed:
+                    break
+                retry, failed[:] = list(failed), []
+                delay = self.rate.backoff(attempt)
+                print(f"[{datetime.now()}] Retrying {len(retry)} attachments in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries + 1})")
+                self.metrics.count('retries', len(retry), stage='attachment', folder=email_data['folder'])
+                time.sleep(delay)
+                for idx in retry:
+                    start(idx)
+                while pending:
+                    finish_oldest()
         
         except Exception as e:
             print(f"[{datetime.now()}] Error downloading attachments: {e}")
         
+        saved_names = {Path(path).name for path in downloaded}
+        email_data['failed_attachments'] = [name for name in names if name not in saved_names]
+        if len(names) < len(email_data['attachments']):
+            # Fewer attachment elements than names in the header: the rest never had a button
+            email_data['failed_attachments'] += email_data['attachments'][len(names):]
         return downloaded
     
-    def scrape_account(self, email, password):
-        """Scrape all emails from an account"""
+    @classmethod
+    def _wait_for_download(cls, download, deadline):
+        """Wait for a download to finish by a time.monotonic() deadline
+
+        Returns the failure message or None. The wait lasts at least
+        MIN_DOWNLOAD_WAIT seconds, so a download that finished while older
+        ones were being waited for is still read. One still running at the
+        deadline is cancelled.
+        """
+        remaining = max(cls.MIN_DOWNLOAD_WAIT, deadline - time.monotonic())
+        try:
+            return cls._download_failure(download, remaining)
+        except asyncio.TimeoutError:
+            download.cancel()
+            raise PlaywrightTimeout("download not finished by its deadline, cancelled")
+    
+    @staticmethod
+    def _download_failure(download, timeout):
+        """Download.failure() with a timeout, which the sync API does not offer
+
+        Runs the async implementation under asyncio.wait_for on Playwright's
+        own event loop. That goes through the private `_sync` and `_impl_obj`
+        of the sync wrapper, so fail clearly if a Playwright release drops them.
+        """
+        run = getattr(download, '_sync', None)
+        impl = getattr(download, '_impl_obj', None)
+        if not callable(run) or not hasattr(impl, 'failure'):
+            raise RuntimeError(
+                "This Playwright version has no Download._sync/_impl_obj.failure(), "
+                "which bounding download times relies on; pin playwright to a release that has them"
+            )
+        return run(asyncio.wait_for(impl.failure(), timeout))
+    
+    @contextmanager
+    def browser_manager(self, wait=True):
+        """Run a BrowserManager with this scraper's browser settings
+
+        Each one is a separate Chromium process tree (a few hundred MB), so
+        at most max_browsers run at once. Waits for a free slot, or with
+        wait=False yields None when there is none.
+        """
+        if not self._browser_slots.acquire(blocking=wait):
+            yield None
+            return
+        try:
+            with BrowserManager(
+                headless=self.headless,
+                block_resources=self.block_resources,
+                block_remote_content=self.block_remote_content,
+                viewport=self.viewport,
+                extra_hosts={urlparse(url).hostname for url in (self.login_url, self.mail_url)} - {'account.proton.me', 'mail.proton.me'},
+                unblocked_pages=(self.login_url,)
+            ) as manager:
+                yield manager
+        finally:
+            self._browser_slots.release()
+    
+    def scrape_account(self, email, password, manager=None):
+        """Scrape all emails from an account
+
+        If a running BrowserManager is passed in, the account runs in its own
+        context of that browser; otherwise a browser is started just for this
+        account.
+        """
         print(f"\n{'='*60}")
         print(f"Starting scrape for: {email}")
         print(f"{'='*60}\n")
         
-        # Check if already completed
+        # Check if already completed (incremental runs revisit every account)
         completed = self.load_completed_accounts()
-        if email in completed:
+        if email in completed and not self.incremental and not self.pending_retries(email):
             print(f"Account {email} already completed. Skipping...")
             return
         
+        try:
+            with self.metrics.timer('account', account=email):
+                if manager is not None:
+                    self._scrape_account_in_browser(manager, email, password)
+                else:
+                    with self.browser_manager() as manager:
+                        self._scrape_account_in_browser(manager, email, password)
+        finally:
+            # Keep a current snapshot on disk, even if the run is interrupted later
+            self.write_metrics()
+    
+    def _scrape_account_in_browser(self, manager, email, password):
+        """Scrape one account in a fresh context of an already running browser"""
         # Load progress
-        progress = self.load_progress()
-        account_progress = progress.get(email, {
+        account_progress = self.load_progress().get(email, {
             'current_folder': 0,
             'completed_folders': []
         })
         
-        with sync_playwright() as p:
-            # Launch browser (headless=False so you can see and handle 2FA/CAPTCHA)
-            browser = p.chromium.launch(headless=False)
-            context = browser.new_context(
-                viewport={'width': 1920, 'height': 1080},
-                user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            )
-            page = context.new_page()
+        session_file = self.session_file(email)
+        has_session = self.reuse_sessions and session_file.exists()
+        
+        context = manager.new_context(storage_state=str(session_file) if has_session else None)
+        page = context.new_page()
+        writer = BackgroundWriter(lambda email_data: self._save_message(email, email_data), self.write_queue_size)
+        
+        try:
+            if not self._login_in_context(context, page, email, password, has_session):
+                print(f"Failed to login to {email}")
+                return
             
-            try:
-                # Login
-                if not self.login(page, email, password):
-                    print(f"Failed to login to {email}")
-                    return
-                
-                # Get folders
+            # Get folders
+            with self.metrics.timer('get_folders', account=email):
                 folders = self.get_folders(page)
-                
-                # Process each folder
-                for idx, folder in enumerate(folders):
-                    if folder['name'] in account_progress['completed_folders']:
+            
+            # Finished folders are only revisited for messages on the retry list
+            retries = self.pending_retries(email)
+            account_done = email in self.load_completed_accounts() and not self.incremental
+            pending = []
+            for idx, folder in enumerate(folders):
+                if account_done or folder['name'] in account_progress['completed_folders']:
+                    if not retries.get(folder['name']):
                         print(f"Folder {folder['name']} already completed. Skipping...")
                         continue
-                    
-                    print(f"\n--- Processing folder {idx+1}/{len(folders)}: {folder['name']} ---")
-                    
-                    # Navigate to folder
-                    if not self.navigate_to_folder(page, folder):
-                        continue
-                    
-                    # Get emails
-                    emails = self.get_emails_in_folder(page, folder, email)
-                    
-                    # Save emails
-                    for email_data in emails:
-                        # Save as .eml
-                        eml_path = self.save_email_as_eml(email_data, email)
-                        print(f"[{datetime.now()}] Saved: {eml_path}")
-                        
-                        # Download attachments if any
-                        if email_data['attachments']:
-                            # Navigate back to email to download attachments
-                            self.navigate_to_folder(page, folder)
-                            time.sleep(1)
-                            
-                            # Find and click the email again
-                            email_items = page.locator('[data-testid="message-item"]').all()
-                            for item in email_items:
-                                if email_data['subject'] in item.inner_text():
-                                    item.click()
-                                    time.sleep(1.5)
-                                    break
-                            
-                            self.download_attachments(page, email_data, email)
-                            
-                            # Go back to folder
-                            page.go_back()
-                            time.sleep(1)
-                    
-                    # Mark folder as completed
-                    account_progress['completed_folders'].append(folder['name'])
-                    account_progress['current_folder'] = idx + 1
-                    progress[email] = account_progress
-                    self.save_progress(progress)
-                    
-                    print(f"[{datetime.now()}] Completed folder: {folder['name']}")
-                
-                # Mark account as completed
-                self.save_completed_account(email)
-                
-                # Clean up progress for this account
-                if email in progress:
-                    del progress[email]
-                    self.save_progress(progress)
-                
-                print(f"\n{'='*60}")
-                print(f"✓ Completed scraping for: {email}")
-                print(f"{'='*60}\n")
-                
-            except Exception as e:
-                print(f"Error scraping account {email}: {e}")
-                import traceback
-                traceback.print_exc()
+                    folder['retry_only'] = True
+                    print(f"Folder {folder['name']}: retrying {len(retries[folder['name']])} emails that failed last time")
+                pending.append((idx, folder))
             
-            finally:
-                browser.close()
+            # Process each folder
+            if self.folder_workers > 1 and len(pending) > 1:
+                self._scrape_folders_concurrently(context, page, pending, len(folders), email, writer, account_progress)
+            else:
+                for idx, folder in pending:
+                    self._scrape_folder(page, idx, folder, len(folders), email, writer, account_progress)
+            
+            # Keep the refreshed tokens for the next run
+            if self.reuse_sessions:
+                self.save_session(context, email)
+            
+            # Progress and checkpoints are what the next run resumes from
+            incomplete = [folder['name'] for _, folder in pending if folder['name'] not in account_progress['completed_folders']]
+            if incomplete:
+                print(f"\n⚠️  {email}: {len(incomplete)} folders not completed ({', '.join(incomplete)}), resuming next run")
+                return
+            
+            # Mark account as completed
+            self.save_completed_account(email)
+            
+            # Clean up progress for this account
+            self.clear_account_progress(email)
+            self.checkpoints.clear_account(email)
+            
+            print(f"\n{'='*60}")
+            print(f"✓ Completed scraping for: {email}")
+            print(f"{'='*60}\n")
+            
+        except Exception as e:
+            print(f"Error scraping account {email}: {e}")
+            self.metrics.count('account_errors', account=email)
+            self.metrics.event('error', stage='account', account=email, error=str(e))
+            import traceback
+            traceback.print_exc()
+        
+        finally:
+            writer.close()
+            self.flush_storage()
+            self.checkpoints.flush()
+            if self.search_index is not None:
+                self.search_index.flush()
+            context.close()
+    
+    def _login_in_context(self, context, page, email, password, has_session):
+        """Log in on a fresh page, unless the saved session is still valid"""
+        with self.metrics.timer('login', account=email):
+            logged_in = has_session and self.restore_session(page, email)
+            if not logged_in:
+                if has_session:
+                    context.clear_cookies()
+                logged_in = self.login(page, email, password)
+                if logged_in and self.reuse_sessions:
+                    self.save_session(context, email)
+        if not logged_in:
+            self.metrics.count('login_failures', account=email)
+            self.metrics.event('error', stage='login', account=email, error="login failed")
+        return logged_in
+    
+    def _save_message(self, email, email_data):
+        """Store one extracted message and record it everywhere (runs on the writer thread)"""
+        spans = email_data.get('timings', {})
+        
+        def record(path):
+            # Only once the message is on disk: resume and incremental runs trust these
+            self.record_archived(email, email_data, path)
+            self.checkpoints.record_message(email, email_data['folder'], email_data['id'], email_data.get('row_key'))
+            with self.metrics.timer('index_email', spans):
+                self.index_email(email, email_data, path)
+            self.metrics.count('messages_saved', account=email, folder=email_data['folder'])
+            if not email_data['failed_attachments']:
+                self.resolve_retry(email, email_data['folder'], email_data['row_key'])
+        
+        # Save as .eml (or into the content store / a bulk backend)
+        with self.metrics.timer('save_email', spans):
+            eml_path = self.save_email(email_data, email, on_durable=record)
+        self.metrics.trace(
+            account=email, folder=email_data['folder'], id=email_data['id'],
+            attachments=len(email_data['attachment_files']),
+            total=round(sum(spans.values()), 4), spans=spans
+        )
+        print(f"[{datetime.now()}] Saved: {eml_path}")
+    
+    def _scrape_folder(self, page, idx, folder, folder_count, email, writer, account_progress):
+        """Scrape one folder on a logged-in page and record it as completed
+
+        A folder is only marked complete when its list was read to the end
+        (folder['coverage']) and every message was saved; messages the writer
+        failed to save go on the retry list. account_progress is None when a
+        work queue tracks completion instead; an incomplete folder then
+        raises so its unit is retried.
+        """
+        print(f"\n--- Processing folder {idx+1}/{folder_count}: {folder['name']} ---")
+        
+        with self.metrics.timer('folder', account=email, folder=folder['name']):
+            # Navigate to folder
+            with self.metrics.timer('navigate_to_folder', folder=folder['name']):
+                opened = self.navigate_to_folder(page, folder)
+            if not opened:
+                if account_progress is None:
+                    raise RuntimeError(f"could not open folder {folder['name']}")
+                return
+            
+            # Stream emails (with their downloaded attachments) to the writer
+            for email_data in self.iter_emails_in_folder(page, folder, email):
+                writer.put(email_data)
+            writer.flush()
+            self.flush_storage()
+            self.checkpoints.flush()
+            if self.search_index is not None:
+                self.search_index.flush()
+            
+            failures = writer.take_failures(folder['name'])
+            for email_data, error in failures:
+                ref = {'key': email_data['row_key'], 'element_id': email_data.get('element_id'), 'subject': email_data['subject']}
+                self.add_retry(email, folder['name'], ref, 'write', error)
+            
+            # Only a list read to its end (or to the cutoff) makes a folder complete
+            coverage = folder.get('coverage') or {'complete': False, 'rows_seen': 0, 'reason': "list was not read"}
+            if account_progress is not None:
+                with self._state_lock:
+                    account_progress.setdefault('coverage', {})[folder['name']] = coverage
+                    if coverage['complete'] and not failures:
+                        if folder['name'] not in account_progress['completed_folders']:
+                            account_progress['completed_folders'].append(folder['name'])
+                        account_progress['current_folder'] = max(account_progress['current_folder'], idx + 1)
+                    self.update_account_progress(email, account_progress)
+            
+            problems = []
+            if failures:
+                print(f"[{datetime.now()}] ⚠️  {len(failures)} emails in {folder['name']} could not be saved, kept in {self.retry_file.name}")
+                problems.append(f"{len(failures)} emails could not be saved")
+            if not coverage['complete']:
+                self.metrics.count('folders_incomplete', account=email, folder=folder['name'])
+                print(f"[{datetime.now()}] ⚠️  {folder['name']} was not listed to the end after {coverage['rows_seen']} rows ({coverage['reason']})")
+                problems.append(f"list incomplete: {coverage['reason']}")
+            if problems:
+                if account_progress is None:
+                    raise RuntimeError("; ".join(problems))
+                return
+        
+        print(f"[{datetime.now()}] Completed folder: {folder['name']}")
+    
+    def _scrape_folders_concurrently(self, context, page, pending, folder_count, email, writer, account_progress):
+        """Spread an account's folders over several browsers through a work queue
+
+        The logged-in page is worker 1. Every other worker is a separate
+        browser on its own thread (sync Playwright pages cannot be shared
+        between threads), not another page of this context: it starts from
+        a copy of this context's cookies and localStorage, and anything the
+        app keeps in sessionStorage is lost. Extra workers only start while
+        max_browsers allows; one whose session is not accepted simply stops
+        and leaves its share of the queue to the others.
+        """
+        work = queue.Queue()
+        for item in pending:
+            work.put(item)
+        state = context.storage_state()
+        errors = []
+        
+        def drain(worker_page, worker_id):
+            while True:
+                try:
+                    idx, folder = work.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self._scrape_folder(worker_page, idx, folder, folder_count, email, writer, account_progress)
+                except Exception as e:
+                    print(f"[{datetime.now()}] Folder worker {worker_id} failed on {folder['name']}: {e}")
+                    errors.append(e)
+        
+        def worker(worker_id):
+            try:
+                with self.browser_manager(wait=False) as manager:
+                    if manager is None:
+                        print(f"[{datetime.now()}] Folder worker {worker_id} not started: {self.max_browsers} browsers already open")
+                        return
+                    worker_context = manager.new_context(storage_state=state)
+                    try:
+                        worker_page = worker_context.new_page()
+                        if not self.restore_session(worker_page, email):
+                            print(f"[{datetime.now()}] Folder worker {worker_id} could not reuse the session, stopping")
+                            return
+                        drain(worker_page, worker_id)
+                    finally:
+                        worker_context.close()
+            except Exception as e:
+                print(f"[{datetime.now()}] Folder worker {worker_id} stopped: {e}")
+        
+        workers = [
+            threading.Thread(target=worker, args=(i + 2,), name=f"folders-{i + 2}")
+            for i in range(min(self.folder_workers, len(pending)) - 1)
+        ]
+        print(f"Processing {len(pending)} folders with up to {len(workers) + 1} browsers")
+        for t in workers:
+            t.start()
+        drain(page, 1)
+        for t in workers:
+            t.join()
+        
+        # Anything left behind by a worker that stopped early
+        drain(page, 1)
+        if errors:
+            raise errors[0]
     
-    def scrape_multiple_accounts(self, accounts):
-        """Scrape multiple accounts"""
+    def scrape_multiple_accounts(self, accounts, concurrency=None):
+        """Scrape multiple accounts
+
+        One browser is kept open for the whole run and every account gets its
+        own context in it. With concurrency > 1 the accounts are spread over
+        that many worker threads, and each worker launches a separate Chromium
+        process (the sync Playwright API cannot share a browser between
+        threads), so memory grows with the number of workers.
+        """
+        concurrency = concurrency or self.concurrency
+        
         print(f"Starting scrape for {len(accounts)} accounts")
         print(f"Date range: Last {self.days_back} days")
         print(f"Cutoff date: {self.cutoff_date.strftime('%Y-%m-%d')}\n")
         
-        for idx, account in enumerate(accounts):
-            print(f"\n[Account {idx+1}/{len(accounts)}]")
-            self.scrape_account(account['email'], account['password'])
-            
-            # Wait between accounts
-            if idx < len(accounts) - 1:
-                print("\nWaiting 10 seconds before next account...")
-                time.sleep(10)
+        if concurrency > 1 and len(accounts) > 1:
+            self._scrape_accounts_concurrently(accounts, concurrency)
+        else:
+            with self.browser_manager() as manager:
+                for idx, account in enumerate(accounts):
+                    print(f"\n[Account {idx+1}/{len(accounts)}]")
+                    self.scrape_account(account['email'], account['password'], manager=manager)
+                    
+                    # Wait between accounts (longer while the server is pushing back)
+                    if idx < len(accounts) - 1:
+                        pause = self.rate.account_pause()
+                        print(f"\nWaiting {pause:.0f} seconds before next account...")
+                        time.sleep(pause)
         
         print("\n" + "="*60)
         print("✓ ALL ACCOUNTS COMPLETED")
         print("="*60)
+        
+        self.print_stage_stats()
+        self.print_wait_stats()
+        metrics_path = self.write_metrics()
+        if metrics_path:
+            print(f"\nMetrics written to {metrics_path}")
+    
+    def _scrape_accounts_concurrently(self, accounts, concurrency):
+        """Run accounts on a bounded pool of workers, one Chromium process each"""
+        work = queue.Queue()
+        for idx, account in enumerate(accounts):
+            work.put((idx, account))
+        
+        def worker(worker_id):
+            # The sync Playwright API is bound to the thread that started it,
+            # so each worker owns its playwright instance and browser.
+            with self.browser_manager() as manager:
+                while True:
+                    try:
+                        idx, account = work.get_nowait()
+                    except queue.Empty:
+                        break
+                    print(f"\n[Worker {worker_id}] [Account {idx+1}/{len(accounts)}]")
+                    try:
+                        self.scrape_account(account['email'], account['password'], manager=manager)
+                    except Exception as e:
+                        print(f"[{datetime.now()}] Worker {worker_id} failed on {account['email']}: {e}")
+        
+        workers = [
+            threading.Thread(target=worker, args=(i + 1,), name=f"scraper-{i + 1}")
+            for i in range(min(concurrency, len(accounts)))
+        ]
+        print(f"Running {len(workers)} accounts at a time")
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+    
+    def run_worker(self, accounts, work_queue, worker_id=None, lease_seconds=300, poll_interval=5.0,
+                   max_sessions=3):
+        """Work through account and folder units of a shared work queue
+
+        Units are claimed one at a time under a lease that a heartbeat
+        thread keeps alive. An account unit logs in and queues the
+        account's folders; a folder unit is scraped like any other folder.
+        Logged-in contexts are kept for the last max_sessions accounts and
+        folder units of those accounts are claimed first, so a worker
+        rarely logs in to the same account twice. Only units of the given
+        accounts are claimed. Returns once they are all done; on the way
+        out (also on Ctrl+C) leased units are handed back to the queue.
+
+        The queue is the only shared state. base_dir belongs to this worker
+        and should be on a local disk (the checkpoint and search databases
+        use WAL, which network filesystems do not support): it holds the
+        messages this worker saved, their index, and checkpoints that let a
+        unit retried on the same host resume. A folder's checkpoints are
+        dropped when its unit starts afresh (first attempt, e.g. after a
+        requeue) and once the unit is done.
+        """
+        credentials = {account['email']: account['password'] for account in accounts}
+        worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        work_queue.register_worker(worker_id)
+        print(f"[{datetime.now()}] Worker {worker_id} joined the queue")
+        
+        # email -> (context, page), least recently opened first
+        sessions = {}
+        try:
+            with self.browser_manager() as manager:
+                try:
+                    while True:
+                        unit = work_queue.claim(worker_id, lease_seconds, list(credentials), list(sessions))
+                        if unit is None:
+                            if work_queue.drained(list(credentials)):
+                                break
+                            # Other workers hold the remaining units; one may die and free them
+                            time.sleep(poll_interval)
+                            continue
+                        self._run_unit(manager, sessions, credentials, work_queue, worker_id, unit,
+                                       lease_seconds, max_sessions)
+                finally:
+                    for email in list(sessions):
+                        self._close_session(sessions, email)
+        finally:
+            work_queue.leave(worker_id)
+            print(f"[{datetime.now()}] Worker {worker_id} left the queue")
+            self.print_stage_stats()
+            self.print_wait_stats()
+            self.write_metrics()
+    
+    def _run_unit(self, manager, sessions, credentials, work_queue, worker_id, unit, lease_seconds, max_sessions):
+        """Process one claimed unit and report the outcome to the queue"""
+        email = unit['account']
+        print(f"\n[{datetime.now()}] Worker {worker_id}: {unit['kind']} unit {email} {unit['folder']} (attempt {unit['attempt']})")
+        
+        with LeaseHeartbeat(work_queue, unit['id'], worker_id, lease_seconds):
+            try:
+                with self.metrics.timer('unit', kind=unit['kind'], account=email):
+                    page = self._account_page(manager, sessions, email, credentials[email], max_sessions)
+                    if unit['kind'] == 'account':
+                        with self.metrics.timer('get_folders', account=email):
+                            folders = self.get_folders(page)
+                        work_queue.add_folders(email, folders)
+                        print(f"[{datetime.now()}] Queued {len(folders)} folders of {email}")
+                    else:
+                        folder = unit['payload']
+                        if unit['attempt'] == 1:
+                            self.checkpoints.clear_folder(email, folder['name'])
+                        writer = BackgroundWriter(lambda email_data: self._save_message(email, email_data), self.write_queue_size)
+                        try:
+                            self._scrape_folder(page, folder['position'], folder, folder['count'], email, writer, None)
+                        finally:
+                            writer.close()
+                            self.flush_storage()
+                            self.checkpoints.flush()
+                            if self.search_index is not None:
+                                self.search_index.flush()
+            except Exception as e:
+                print(f"[{datetime.now()}] Unit {email} {unit['folder']} failed: {e}")
+                self.metrics.event('error', stage='unit', kind=unit['kind'], account=email, folder=unit['folder'], error=str(e))
+                work_queue.fail(unit['id'], worker_id, e)
+                # A broken session may be the cause, so log in afresh next time
+                self._close_session(sessions, email)
+                return
+        
+        if not work_queue.complete(unit['id'], worker_id):
+            print(f"[{datetime.now()}] ⚠️  Unit {email} {unit['folder']} finished after its lease had passed to another worker")
+        elif unit['kind'] == 'folder':
+            self.checkpoints.clear_folder(email, unit['folder'])
+    
+    def _account_page(self, manager, sessions, email, password, max_sessions):
+        """Logged-in page for an account, reusing this worker's open sessions"""
+        if email in sessions:
+            return sessions[email][1]
+        while len(sessions) >= max_sessions:
+            self._close_session(sessions, next(iter(sessions)))
+        
+        session_file = self.session_file(email)
+        has_session = self.reuse_sessions and session_file.exists()
+        context = manager.new_context(storage_state=str(session_file) if has_session else None)
+        page = context.new_page()
+        if not self._login_in_context(context, page, email, password, has_session):
+            context.close()
+            raise RuntimeError(f"Failed to login to {email}")
+        sessions[email] = (context, page)
+        return page
+    
+    def _close_session(self, sessions, email):
+        if email not in sessions:
+            return
+        context, _ = sessions.pop(email)
+        try:
+            if self.reuse_sessions:
+                self.save_session(context, email)
+            context.close()
+        except Exception as e:
+            print(f"[{datetime.now()}] Could not close the session of {email}: {e}")
 
 
 # Example usage
@@ -520,10 +3248,11 @@ if __name__ == "__main__":
         # Add more accounts as needed
     ]
     
-    # Create scraper (last 30 days)
+    # Create scraper (last 30 days, one account at a time)
     scraper = ProtonMailScraper(
         base_dir="protonmail_data",
-        days_back=30
+        days_back=30,
+        concurrency=1
     )
     
     # Scrape all accounts
@@ -0,0 +1,57 @@
+import argparse
+from pathlib import Path
+
+from proton_scraping import ProtonMailScraper, SearchIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the scraped ProtonMail archive")
+    parser.add_argument('query', nargs='?', help='Search terms (SQLite FTS5 syntax, e.g. "invoice AND sender:alice")')
+    parser.add_argument('--base-dir', default='protonmail_data', help='Archive directory (default: protonmail_data)')
+    parser.add_argument('--account', help='Only search this account, e.g. you@proton.me')
+    parser.add_argument('--folder', help='Only search this folder, e.g. Inbox')
+    parser.add_argument('--limit', type=int, default=20, help='Maximum number of results (default: 20)')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the index from the saved files first')
+    parser.add_argument('--paths-only', action='store_true', help='Print only the file paths of the matches')
+    args = parser.parse_args()
+
+    if not args.query and not args.rebuild:
+        parser.error("give a query, --rebuild, or both")
+
+    base_dir = Path(args.base_dir)
+    index_path = base_dir / "search.db"
+    if args.rebuild:
+        if not base_dir.is_dir():
+            parser.error(f"no archive at {base_dir}")
+        # Only the rebuild needs the scraper; metrics and the live index stay off
+        scraper = ProtonMailScraper(base_dir=base_dir, search_index=False, metrics=None)
+        scraper.rebuild_search_index()
+        scraper.search_index.close()
+    elif not index_path.exists():
+        parser.error(f"no search index at {index_path}; run with --rebuild to build it from the saved files")
+
+    if not args.query:
+        return
+
+    # Opened directly, so searching never creates or changes anything in the archive
+    index = SearchIndex(index_path)
+    try:
+        results = index.search(args.query, args.account, args.folder, args.limit)
+    finally:
+        index.close()
+    for result in results:
+        if args.paths_only:
+            print(result['path'])
+            continue
+        print(result['path'])
+        print(f"    {result['date']} | {result['folder']} | {result['from']}")
+        print(f"    {result['subject']}")
+        if result['snippet']:
+            print(f"    {' '.join(result['snippet'].split())}")
+
+    if not args.paths_only:
+        print(f"\n{len(results)} result(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import pytest
+
+from proton_scraping import CheckpointStore
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "checkpoints.db"
+
+
+def test_restarted_run_sees_the_saved_messages(path):
+    store = CheckpointStore(path, batch_size=2, max_delay=3600)
+    store.record_message("me@proton.me", "Inbox", "id1", "key1")
+    store.record_message("me@proton.me", "Inbox", "id2", "key2")
+    store.record_message("me@proton.me", "Sent", "id3")
+    store.close()
+    
+    resumed = CheckpointStore(path)
+    
+    assert resumed.saved_messages("me@proton.me", "Inbox") == ({"id1", "id2"}, {"key1", "key2"})
+    assert resumed.saved_messages("me@proton.me", "Sent") == ({"id3"}, set())
+    assert resumed.saved_messages("other@proton.me", "Inbox") == (set(), set())
+
+
+def test_a_crash_loses_at_most_the_open_batch(path):
+    store = CheckpointStore(path, batch_size=3, max_delay=3600)
+    for n in range(4):
+        store.record_message("me@proton.me", "Inbox", f"id{n}", f"key{n}")
+    
+    # A second connection only sees committed batches, like a run after a crash
+    other = CheckpointStore(path)
+    assert other.saved_messages("me@proton.me", "Inbox")[0] == {"id0", "id1", "id2"}
+    
+    store.flush()
+    assert other.saved_messages("me@proton.me", "Inbox")[0] == {"id0", "id1", "id2", "id3"}
+
+
+def test_recording_a_message_again_keeps_one_checkpoint(path):
+    store = CheckpointStore(path)
+    store.record_message("me@proton.me", "Inbox", "id1", "old")
+    store.record_message("me@proton.me", "Inbox", "id1", "new")
+    store.flush()
+    
+    assert store.saved_messages("me@proton.me", "Inbox") == ({"id1"}, {"new"})
+
+
+def test_clearing_forgets_folders_and_accounts(path):
+    store = CheckpointStore(path)
+    store.record_message("me@proton.me", "Inbox", "id1")
+    store.record_message("me@proton.me", "Sent", "id2")
+    store.record_message("you@proton.me", "Inbox", "id3")
+    
+    store.clear_folder("me@proton.me", "Inbox")
+    assert store.saved_messages("me@proton.me", "Inbox")[0] == set()
+    assert store.saved_messages("me@proton.me", "Sent")[0] == {"id2"}
+    
+    store.clear_account("me@proton.me")
+    assert store.saved_messages("me@proton.me", "Sent")[0] == set()
+    assert store.saved_messages("you@proton.me", "Inbox")[0] == {"id3"}
@@ -0,0 +1,48 @@
+import gzip
+
+import pytest
+
+from proton_scraping import ContentStore
+
+
+@pytest.mark.parametrize("compression", [None, 'gzip'])
+def test_content_store_deduplicates_and_reads_back(tmp_path, compression):
+    store = ContentStore(tmp_path, compression=compression)
+    
+    first = store.put_bytes(b"same content")
+    second = store.put_bytes(b"same content")
+    
+    assert first == second
+    assert (store.written, store.deduplicated) == (1, 1)
+    assert store.get(first) == b"same content"
+
+
+def test_content_store_compresses_objects(tmp_path):
+    store = ContentStore(tmp_path, compression='gzip')
+    digest = store.put_bytes(b"x" * 1000)
+    
+    path = store.object_path(digest)
+    assert path.suffix == '.gz'
+    assert gzip.decompress(path.read_bytes()) == b"x" * 1000
+
+
+def test_content_store_finds_objects_written_with_other_compression(tmp_path):
+    digest = ContentStore(tmp_path, compression='gzip').put_bytes(b"data")
+    
+    assert ContentStore(tmp_path).get(digest) == b"data"
+
+
+def test_content_store_put_file(tmp_path):
+    source = tmp_path / "attachment.bin"
+    source.write_bytes(b"attachment")
+    store = ContentStore(tmp_path / "objects")
+    
+    digest = store.put_file(source, remove=True)
+    
+    assert store.get(digest) == b"attachment"
+    assert not source.exists()
+
+
+def test_content_store_rejects_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        ContentStore(tmp_path, compression='lz4')
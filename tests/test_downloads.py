@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+import pytest
+
+from proton_scraping import PlaywrightTimeout, ProtonMailScraper
+
+
+class FakeImpl:
+    def __init__(self, seconds, failure=None):
+        self.seconds = seconds
+        self.result = failure
+    
+    async def failure(self):
+        await asyncio.sleep(self.seconds)
+        return self.result
+
+
+class FakeDownload:
+    """Shaped like playwright's sync Download: a wrapper around the async one"""
+    
+    def __init__(self, seconds, failure=None):
+        self._impl_obj = FakeImpl(seconds, failure)
+        self.cancelled = False
+    
+    def _sync(self, coro):
+        return asyncio.run(coro)
+    
+    def cancel(self):
+        self.cancelled = True
+
+
+@pytest.fixture(autouse=True)
+def short_floor(monkeypatch):
+    monkeypatch.setattr(ProtonMailScraper, 'MIN_DOWNLOAD_WAIT', 0.2)
+
+
+def test_finished_download_returns_its_failure():
+    download = FakeDownload(0, failure="net::ERR_FAILED")
+    
+    assert ProtonMailScraper._wait_for_download(download, time.monotonic() + 10) == "net::ERR_FAILED"
+
+
+def test_download_past_its_deadline_still_gets_the_minimum_wait():
+    download = FakeDownload(0.05)
+    
+    assert ProtonMailScraper._wait_for_download(download, time.monotonic() - 30) is None
+    assert not download.cancelled
+
+
+def test_download_running_at_the_deadline_is_cancelled():
+    download = FakeDownload(5)
+    
+    start = time.monotonic()
+    with pytest.raises(PlaywrightTimeout):
+        ProtonMailScraper._wait_for_download(download, start + 0.3)
+    
+    assert download.cancelled
+    assert time.monotonic() - start < 2
+
+
+def test_missing_playwright_internals_fail_clearly():
+    class NewerDownload:
+        def cancel(self):
+            pass
+    
+    with pytest.raises(RuntimeError, match="_sync/_impl_obj"):
+        ProtonMailScraper._wait_for_download(NewerDownload(), time.monotonic() + 1)
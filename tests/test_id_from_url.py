@@ -0,0 +1,23 @@
+import pytest
+
+from proton_scraping import ProtonMailScraper
+
+CONVERSATION = "aB3dE5fG7hI9jK1lM3nO5pQ7rS9tU1vW3xY5zA7bC9dE1fG3hI5jK7lM9nO1pQ3rS5tU7vW9xY1zA3bC5dE7fG9hI1j=="
+LABEL = "Zy8Xw6Vu4Ts2Rq0Po8Nm6Lk4Ji2Hg0Fe8Dc6Ba4Zy2Xw0Vu8Ts6Rq4Po2Nm0Lk8Ji6Hg4Fe2Dc0Ba8Zy6Xw4Vu2Ts0=="
+
+
+@pytest.fixture
+def scraper(tmp_path):
+    return ProtonMailScraper(base_dir=tmp_path, search_index=False, metrics=None)
+
+
+@pytest.mark.parametrize("url, expected", [
+    (f"https://mail.proton.me/u/0/inbox/{CONVERSATION}", CONVERSATION),
+    (f"https://mail.proton.me/u/0/inbox/{CONVERSATION}?page=2#details", CONVERSATION),
+    (f"https://mail.proton.me/u/0/{LABEL}/{CONVERSATION}", CONVERSATION),
+    (f"https://mail.proton.me/u/0/{LABEL}/{CONVERSATION}/", CONVERSATION),
+    ("https://mail.proton.me/u/0/inbox", None),
+    ("https://mail.proton.me/u/0/inbox/short", None),
+])
+def test_id_from_url_takes_the_last_path_segment(scraper, url, expected):
+    assert scraper._id_from_url(url) == expected
@@ -0,0 +1,172 @@
+from datetime import datetime
+
+import pytest
+
+from proton_scraping import (LIST_CHANGED_JS, SCROLL_LIST_JS, MessageListHarvester,
+                             ProtonMailScraper)
+
+
+class FakeList:
+    """A virtualized message list that renders `window` rows at a time
+
+    Scrolling down moves by `step` rows (window - 1 keeps the last row on
+    screen, like scrolling it into view does); scrolling up moves a window.
+    """
+    
+    def __init__(self, count, window=5, step=None):
+        self.rows = [{'element_id': f"id{n:04d}", 'text': f"row {n}", 'date': None} for n in range(count)]
+        self.window = window
+        self.step = step or window - 1
+        self.start = 0
+        self.scrolls = []
+    
+    def rendered(self):
+        return self.rows[self.start:self.start + self.window]
+    
+    def evaluate(self, script, arg=None):
+        assert script == SCROLL_LIST_JS
+        self.scrolls.append(arg or 'down')
+        move = -self.window if arg == 'up' else self.step
+        self.start = max(0, min(len(self.rows) - self.window, self.start + move))
+    
+    def changed(self, edge, signature):
+        rows = self.rendered()
+        row = rows[0] if edge == 'first' else rows[-1]
+        return MessageListHarvester._signature(row) != signature
+    
+    def locator(self, selector):
+        return FakeLocator(lambda: False)
+
+
+class FakeLocator:
+    def __init__(self, present):
+        self.present = present
+        self.first = self
+    
+    def count(self):
+        return 1 if self.present() else 0
+
+
+@pytest.fixture
+def scraper(tmp_path):
+    scraper = ProtonMailScraper(base_dir=tmp_path, search_index=False, metrics=None)
+    
+    def wait_for(page, step, function=None, arg=None, **kwargs):
+        assert function == LIST_CHANGED_JS
+        return page.changed(*arg)
+    
+    scraper.extract_list_rows = lambda page: page.rendered()
+    scraper.wait_for = wait_for
+    scraper.locate_row = lambda page, ref: FakeLocator(
+        lambda: any(row['element_id'] == ref['element_id'] for row in page.rendered()))
+    return scraper
+
+
+def harvest(scraper, page):
+    harvester = MessageListHarvester(scraper, page, {'name': 'Inbox'})
+    return harvester, list(harvester)
+
+
+def test_harvester_reads_every_row_of_a_virtualized_list(scraper):
+    page = FakeList(23)
+    
+    harvester, refs = harvest(scraper, page)
+    
+    assert [ref['element_id'] for ref in refs] == [row['element_id'] for row in page.rows]
+    assert [ref['position'] for ref in refs] == list(range(1, 24))
+    assert harvester.complete
+
+
+def test_harvester_reports_rows_skipped_by_a_jump(scraper):
+    page = FakeList(30, window=5, step=10)
+    
+    harvester, refs = harvest(scraper, page)
+    
+    assert len(refs) < 30
+    assert not harvester.complete
+    assert "skipped rows" in harvester.stop_reason
+
+
+def test_scroll_to_row_scrolls_back_up_to_an_earlier_row(scraper):
+    page = FakeList(40)
+    harvester = MessageListHarvester(scraper, page, {'name': 'Inbox'})
+    refs = iter(harvester)
+    read = [next(refs) for _ in range(20)]
+    
+    assert scraper.scroll_to_row(page, read[2], harvester.positions)
+    assert 'up' in page.scrolls
+    
+    # The harvester carries on from where it was, without losing rows
+    rest = list(refs)
+    assert [ref['element_id'] for ref in read + rest] == [row['element_id'] for row in page.rows]
+    assert harvester.complete
+
+
+def test_scroll_to_row_never_scrolls_past_unread_rows(scraper):
+    page = FakeList(40)
+    harvester = MessageListHarvester(scraper, page, {'name': 'Inbox'})
+    refs = iter(harvester)
+    read = [next(refs) for _ in range(10)]
+    page.start = 0  # back navigation re-rendered the list from the top
+    
+    assert scraper.scroll_to_row(page, read[-1], harvester.positions)
+    assert [ref['element_id'] for ref in read + list(refs)] == [row['element_id'] for row in page.rows]
+
+
+def test_scroll_to_row_gives_up_on_a_row_gone_from_its_window(scraper):
+    page = FakeList(12)
+    harvester = MessageListHarvester(scraper, page, {'name': 'Inbox'})
+    refs = iter(harvester)
+    read = [next(refs) for _ in range(3)]
+    del page.rows[1]
+    
+    assert not scraper.scroll_to_row(page, read[1], harvester.positions)
+    assert page.scrolls == []
+
+
+def test_scroll_to_row_accepts_a_row_rendered_by_a_load_in_flight(scraper):
+    page = FakeList(12)
+    harvester = MessageListHarvester(scraper, page, {'name': 'Inbox'})
+    refs = iter(harvester)
+    read = [next(refs) for _ in range(8)]
+    page.start, page.window, page.scrolls = 0, 4, []
+    
+    def extract_list_rows(page):
+        # The next page arrives between the row check and this read
+        page.window = 12
+        return page.rendered()
+    
+    scraper.extract_list_rows = extract_list_rows
+    
+    assert scraper.scroll_to_row(page, read[-1], harvester.positions)
+    assert page.scrolls == []
+
+
+def test_harvester_keeps_rows_from_the_cutoff_day_without_a_time(scraper):
+    page = FakeList(4)
+    for row, text in zip(page.rows, ["May 2, 2024", "May 1, 2024", "May 1, 2024 9:00 AM", "Apr 30, 2024"]):
+        row['date'] = text
+    scraper.cutoff_date = datetime(2024, 5, 1, 15, 30)
+    
+    harvester, refs = harvest(scraper, page)
+    
+    assert [ref['date'] for ref in refs] == ["May 2, 2024", "May 1, 2024"]
+    assert harvester.complete
+    assert "reached cutoff" in harvester.stop_reason
+
+
+def test_identical_rows_without_ids_are_all_read(scraper):
+    page = FakeList(6, window=6)
+    for row in page.rows:
+        row['element_id'] = None
+    page.rows[2]['text'] = page.rows[3]['text'] = "Daily report"
+    page.rows[4]['text'] = page.rows[5]['text'] = "Daily report"
+    page.rows[4]['date'] = page.rows[5]['date'] = "May 1, 2024"
+    scraper.cutoff_date = datetime(2024, 4, 1)
+    
+    harvester, refs = harvest(scraper, page)
+    
+    assert len(refs) == 6
+    assert len({ref['key'] for ref in refs}) == 6
+    assert [ref['occurrence'] for ref in refs[2:]] == [1, 2, 1, 2]
+    assert harvester.complete
@@ -0,0 +1,72 @@
+import mailbox
+from email.message import EmailMessage
+
+from proton_scraping import MaildirBackend, MboxBackend
+
+
+def make_message(subject, body):
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg.set_content(body)
+    return msg
+
+
+def test_mbox_backend_reports_messages_only_after_fsync(tmp_path):
+    backend = MboxBackend(tmp_path, batch_size=2)
+    durable = []
+    
+    backend.save(make_message("one", "first"), "me_at_proton.me", "Inbox", durable.append)
+    assert durable == []
+    backend.save(make_message("two", "second"), "me_at_proton.me", "Inbox", durable.append)
+    assert len(durable) == 2
+    backend.save(make_message("three", "third"), "me_at_proton.me", "Inbox", durable.append)
+    assert len(durable) == 2
+    backend.flush()
+    assert len(durable) == 3
+
+
+def test_mbox_backend_escapes_from_lines(tmp_path):
+    backend = MboxBackend(tmp_path)
+    path = backend.save(make_message("quoted", "From here on\n>From there\n"), "me_at_proton.me", "Work/Projects")
+    backend.flush()
+    
+    assert path.name == "Work_Projects.mbox"
+    messages = list(mailbox.mbox(str(path)))
+    assert [m['Subject'] for m in messages] == ["quoted"]
+    payload = messages[0].get_payload()
+    assert ">From here on" in payload
+    assert ">>From there" in payload
+
+
+def test_mbox_backend_appends_across_flushes(tmp_path):
+    backend = MboxBackend(tmp_path)
+    backend.save(make_message("one", "first"), "me_at_proton.me", "Inbox")
+    backend.flush()
+    path = backend.save(make_message("two", "second"), "me_at_proton.me", "Inbox")
+    backend.flush()
+    
+    assert [m['Subject'] for m in mailbox.mbox(str(path))] == ["one", "two"]
+
+
+def test_maildir_backend_delivers_each_message_as_a_durable_file(tmp_path):
+    backend = MaildirBackend(tmp_path)
+    durable = []
+    
+    first = backend.save(make_message("one", "first"), "me_at_proton.me", "Work/Projects", durable.append)
+    second = backend.save(make_message("two", "second"), "me_at_proton.me", "Work/Projects", durable.append)
+    
+    assert durable == [first, second]
+    assert first.parent == tmp_path / "me_at_proton.me" / "maildir" / "Work_Projects" / "new"
+    assert first.exists() and second.exists()
+    assert sorted(m['Subject'] for m in mailbox.Maildir(str(first.parent.parent))) == ["one", "two"]
+
+
+def test_maildir_backend_keeps_folders_apart_across_flushes(tmp_path):
+    backend = MaildirBackend(tmp_path)
+    inbox = backend.save(make_message("one", "first"), "me_at_proton.me", "Inbox")
+    backend.flush()
+    sent = backend.save(make_message("two", "second"), "me_at_proton.me", "Sent")
+    backend.save(make_message("three", "third"), "me_at_proton.me", "Inbox")
+    
+    assert [m['Subject'] for m in mailbox.Maildir(str(sent.parent.parent))] == ["two"]
+    assert sorted(m['Subject'] for m in mailbox.Maildir(str(inbox.parent.parent))) == ["one", "three"]
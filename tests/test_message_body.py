@@ -0,0 +1,61 @@
+import base64
+
+from proton_scraping import MessageBody, ProtonMailScraper
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 16
+PNG_URI = "data:image/png;base64," + base64.b64encode(PNG).decode()
+
+
+def test_message_body_moves_inline_images_to_cid_parts():
+    body = MessageBody('<p>Hi</p><img src="inline-image:0"><img src="inline-image:1">', [PNG_URI, PNG_URI])
+    
+    assert len(body.images) == 1
+    cid, (maintype, subtype, data) = next(iter(body.images.items()))
+    assert (maintype, subtype, data) == ('image', 'png', PNG)
+    assert body.html.count(f'src="cid:{cid}"') == 2
+    assert 'base64' not in body.html
+
+
+def test_message_body_converts_data_uris_left_in_the_html():
+    body = MessageBody(f'<img src="{PNG_URI}"><img src="https://example.com/a.png">')
+    
+    assert len(body.images) == 1
+    assert 'src="https://example.com/a.png"' in body.html
+
+
+def test_message_body_keeps_unknown_images_as_they_were():
+    body = MessageBody('<img src="inline-image:0"><img src="inline-image:5">', ["https://example.com/a.png"])
+    
+    assert body.images == {}
+    assert 'src="https://example.com/a.png"' in body.html
+    assert 'src="inline-image:5"' in body.html
+
+
+def test_message_body_text_is_derived_from_html():
+    body = MessageBody("<div>Hello&nbsp;<b>there</b></div><p>Second</p>")
+    
+    assert "Hello" in body.text and "there" in body.text
+    assert body.text.index("Hello") < body.text.index("Second")
+
+
+def test_text_is_only_derived_when_asked_for():
+    body = MessageBody("<p>Hello</p>")
+    
+    assert body._text is None
+    assert body.text == body.text
+    assert body._text is not None
+
+
+def test_email_message_carries_inline_images_as_related_parts(tmp_path):
+    scraper = ProtonMailScraper(base_dir=tmp_path, search_index=False, metrics=None)
+    body = MessageBody('<p>Logo</p><img src="inline-image:0"><img src="inline-image:0">', [PNG_URI])
+    email_data = {'subject': "Hi", 'from': "alice@example.com", 'date': "Mon, 4 Mar 2024 10:32:00 +0000", 'body': body}
+    
+    msg = scraper.build_email_message(email_data)
+    
+    [image] = [part for part in msg.walk() if part.get_content_maintype() == 'image']
+    assert image.get_content() == PNG
+    assert image['Content-ID'] == f"<{next(iter(body.images))}>"
+    assert msg.get_body(('html',)).get_content().count(f"cid:{next(iter(body.images))}") == 2
+    # The same message always serializes to the same bytes
+    assert scraper.build_email_message(email_data).as_bytes() == msg.as_bytes()
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from proton_scraping import RunMetrics
+
+
+def samples(text):
+    """Sample lines of a Prometheus exposition as {series: value}"""
+    return {
+        line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+        for line in text.splitlines() if line and not line.startswith('#')
+    }
+
+
+def test_prometheus_histogram_is_cumulative():
+    metrics = RunMetrics()
+    for seconds in (0.01, 0.2, 0.2, 3.0, 500.0):
+        metrics.observe('message', seconds, folder='Inbox')
+    
+    series = samples(metrics.prometheus())
+    
+    bucket = 'protonmail_scraper_stage_seconds_bucket{stage="message",folder="Inbox",le="%s"}'
+    assert series[bucket % '0.05'] == 1
+    assert series[bucket % '0.25'] == 3
+    assert series[bucket % '5'] == 4
+    assert series[bucket % '300'] == 4
+    assert series[bucket % '+Inf'] == 5
+    assert series['protonmail_scraper_stage_seconds_count{stage="message",folder="Inbox"}'] == 5
+    assert series['protonmail_scraper_stage_seconds_sum{stage="message",folder="Inbox"}'] == pytest.approx(503.41)
+
+
+def test_prometheus_counts_errors_and_counters():
+    metrics = RunMetrics()
+    with pytest.raises(RuntimeError):
+        with metrics.timer('save_email'):
+            raise RuntimeError("disk full")
+    with metrics.timer('save_email'):
+        pass
+    metrics.count('messages_saved', 3, account='me@proton.me')
+    metrics.count('messages_saved', 2, account='me@proton.me')
+    
+    text = metrics.prometheus(prefix='scraper')
+    series = samples(text)
+    
+    assert series['scraper_stage_errors_total{stage="save_email"}'] == 1
+    assert series['scraper_stage_seconds_count{stage="save_email"}'] == 2
+    assert series['scraper_messages_saved_total{account="me@proton.me"}'] == 5
+    assert "# TYPE scraper_messages_saved_total counter" in text
+    assert "scraper_run_seconds" in series
+
+
+def test_prometheus_escapes_label_values():
+    metrics = RunMetrics()
+    metrics.count('errors', folder='Say "hi"\\now\n')
+    
+    assert 'protonmail_scraper_errors_total{folder="Say \\"hi\\"\\\\now\\n"} 1' in metrics.prometheus()
+
+
+def test_stages_are_logged_as_json_lines(tmp_path):
+    metrics = RunMetrics(log_path=tmp_path / "events.jsonl")
+    metrics.observe('login', 1.5, account='me@proton.me')
+    metrics.close()
+    
+    [record] = [json.loads(line) for line in (tmp_path / "events.jsonl").read_text().splitlines()]
+    assert (record['event'], record['stage'], record['seconds'], record['account']) == ('stage', 'login', 1.5, 'me@proton.me')
@@ -0,0 +1,48 @@
+from datetime import date, datetime
+
+import pytest
+
+from proton_scraping import _parse_date_cached
+
+TODAY = date(2024, 5, 1)  # a Wednesday
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Message header formats
+    ("Mar 4, 2024", datetime(2024, 3, 4)),
+    ("4 Mar 2024", datetime(2024, 3, 4)),
+    ("Tue, Mar 4th, 2024 at 10:32 AM", datetime(2024, 3, 4, 10, 32)),
+    ("2024-03-04T10:32:00", datetime(2024, 3, 4, 10, 32)),
+    ("2024/03/04", datetime(2024, 3, 4)),
+    # Message list formats
+    ("10:32", datetime(2024, 5, 1, 10, 32)),
+    ("3:15 PM", datetime(2024, 5, 1, 15, 15)),
+    ("Today", datetime(2024, 5, 1)),
+    ("Yesterday", datetime(2024, 4, 30)),
+    ("Mon", datetime(2024, 4, 29)),
+    ("Mar 4", datetime(2024, 3, 4)),
+    ("Dec 24", datetime(2023, 12, 24)),
+])
+def test_known_formats(text, expected):
+    assert _parse_date_cached(text, TODAY) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("13/03/2024", datetime(2024, 3, 13)),   # day first
+    ("03/13/2024", datetime(2024, 3, 13)),   # month first
+    ("13.03.24", datetime(2024, 3, 13)),     # two-digit year
+    ("03/13/24 9:05", datetime(2024, 3, 13, 9, 5)),
+    ("05/05/24", datetime(2024, 5, 5)),      # same either way
+])
+def test_unambiguous_numeric_dates(text, expected):
+    assert _parse_date_cached(text, TODAY) == expected
+
+
+@pytest.mark.parametrize("text", ["03/04/24", "03/04/2024", "1/2/2024", "31/02/2024", "03/04/123"])
+def test_ambiguous_or_invalid_numeric_dates_give_none(text):
+    assert _parse_date_cached(text, TODAY) is None
+
+
+@pytest.mark.parametrize("text", ["", "   ", "draft", "Feb 30, 2024"])
+def test_unparseable_gives_none(text):
+    assert _parse_date_cached(text, TODAY) is None
@@ -0,0 +1,61 @@
+from proton_scraping import RateController
+
+
+def test_failures_back_off_multiplicatively():
+    rate = RateController(max_parallel=4, delay_step=0.1)
+    
+    assert rate.record(1.0, ok=False)
+    assert (rate.delay, rate.parallel) == (0.1, 2)
+    rate.record(1.0, ok=False)
+    assert (rate.delay, rate.parallel) == (0.2, 1)
+    rate.record(1.0, ok=False)
+    assert rate.parallel == 1
+
+
+def test_slow_responses_count_as_pushback():
+    rate = RateController(max_parallel=4, target_latency=1.0)
+    
+    rate.record(5.0)
+    
+    assert rate.delay > 0
+    assert rate.parallel == 2
+
+
+def test_successes_recover_additively():
+    rate = RateController(max_parallel=3, target_latency=1.0, delay_step=0.1, increase_every=2)
+    rate.record(0.1, ok=False)
+    assert rate.parallel == 1
+    
+    for _ in range(4):
+        rate.record(0.1)
+    
+    assert rate.delay == 0.0
+    assert rate.parallel == 3
+
+
+def test_delay_is_capped():
+    rate = RateController(max_delay=1.0)
+    
+    for _ in range(20):
+        rate.record(1.0, ok=False)
+    
+    assert rate.delay == 1.0
+    assert rate.account_pause() == 10.0
+
+
+def test_disabled_controller_only_observes():
+    rate = RateController(max_parallel=3, enabled=False)
+    
+    assert not rate.record(10.0, ok=False)
+    
+    assert (rate.delay, rate.parallel) == (0.0, 3)
+    assert rate.state()['error_rate'] == 0.1
+
+
+def test_backoff_is_jittered_and_capped():
+    rate = RateController(backoff_base=1.0, backoff_cap=5.0)
+    
+    waits = [rate.backoff(attempt) for attempt in (1, 2, 10) for _ in range(50)]
+    
+    assert all(0 <= wait <= 5.0 for wait in waits)
+    assert len(set(waits)) > 1
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from proton_scraping import ProtonMailScraper
+
+
+@pytest.fixture
+def make_scraper(tmp_path):
+    return lambda: ProtonMailScraper(base_dir=tmp_path, search_index=False, metrics=None)
+
+
+def test_failed_message_survives_a_restart(make_scraper):
+    scraper = make_scraper()
+    ref = {'key': "id1", 'element_id': "id1", 'subject': "Report"}
+    scraper.add_retry("me@proton.me", "Inbox", ref, 'attachments', RuntimeError("timeout"))
+    scraper.add_retry("me@proton.me", "Inbox", ref, 'message', RuntimeError("gone"))
+    
+    resumed = make_scraper()
+    
+    assert resumed.pending_retries("me@proton.me", "Inbox") == {"id1"}
+    assert resumed.pending_retries("me@proton.me") == {"Inbox": {"id1"}}
+    entry = json.loads(resumed.retry_file.read_text())["me@proton.me"]["Inbox"]["id1"]
+    assert (entry['runs'], entry['reason'], entry['error']) == (2, 'message', "gone")
+
+
+def test_resolved_message_leaves_no_empty_entries(make_scraper):
+    scraper = make_scraper()
+    scraper.add_retry("me@proton.me", "Inbox", {'key': "id1"}, 'message', "failed")
+    scraper.add_retry("me@proton.me", "Sent", {'key': "id2"}, 'message', "failed")
+    
+    scraper.resolve_retry("me@proton.me", "Inbox", "id1")
+    scraper.resolve_retry("me@proton.me", "Inbox", "unknown")
+    saved = json.loads(scraper.retry_file.read_text())
+    assert {folder: set(entries) for folder, entries in saved["me@proton.me"].items()} == {"Sent": {"id2"}}
+    
+    scraper.resolve_retry("me@proton.me", "Sent", "id2")
+    assert json.loads(scraper.retry_file.read_text()) == {}
+    assert make_scraper().pending_retries("me@proton.me") == {}
@@ -0,0 +1,55 @@
+import pytest
+
+from proton_scraping import SearchIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SearchIndex(tmp_path / "search.db")
+    yield index
+    index.close()
+
+
+def add(index, message_id, subject, body, folder="Inbox", path=None, attachments=()):
+    index.add("me@proton.me", folder, message_id, path or f"/archive/{message_id}.eml",
+              subject, "alice@example.com", "Mar 4, 2024", body, list(attachments))
+
+
+def test_search_finds_messages_by_body_subject_and_attachment(index):
+    add(index, "id1", "Quarterly report", "Numbers are up", attachments=["report.pdf"])
+    add(index, "id2", "Lunch", "Pizza on friday")
+    
+    assert [hit['subject'] for hit in index.search("numbers")] == ["Quarterly report"]
+    assert [hit['subject'] for hit in index.search("subject:lunch")] == ["Lunch"]
+    assert [hit['path'] for hit in index.search("report.pdf")] == ["/archive/id1.eml"]
+
+
+def test_adding_a_message_again_replaces_its_entry(index):
+    add(index, "id1", "Draft", "first version", path="/archive/old.eml")
+    add(index, "id1", "Draft", "second version", path="/archive/new.eml")
+    
+    assert index.search("first") == []
+    hits = index.search("second")
+    assert [hit['path'] for hit in hits] == ["/archive/new.eml"]
+    assert len(index.search("draft")) == 1
+
+
+def test_query_that_is_not_valid_fts_falls_back_to_plain_terms(index):
+    add(index, "id1", "Invoice", 'Please pay "invoice 42" AND more')
+    add(index, "id2", "Other", "Nothing to see")
+    
+    hits = index.search('invoice AND')
+    
+    assert [hit['subject'] for hit in hits] == ["Invoice"]
+    assert '[' in hits[0]['snippet']
+
+
+def test_search_filters_by_folder_and_clear_empties_the_index(index):
+    add(index, "id1", "Hello", "same words", folder="Inbox")
+    add(index, "id2", "Hello", "same words", folder="Sent")
+    
+    assert [hit['folder'] for hit in index.search("words", folder_name="Sent")] == ["Sent"]
+    assert index.search("words", account_email="other@proton.me") == []
+    
+    index.clear()
+    assert index.search("words") == []
@@ -0,0 +1,135 @@
+import time
+
+import pytest
+
+from proton_scraping import LeaseHeartbeat, SqliteWorkQueue
+
+FOLDERS = [{'name': 'Inbox', 'selector': '#inbox'}, {'name': 'Sent', 'selector': '#sent'}]
+
+
+@pytest.fixture
+def work_queue(tmp_path):
+    work_queue = SqliteWorkQueue(tmp_path / "queue.db", max_attempts=2)
+    work_queue.register_worker("a")
+    work_queue.register_worker("b")
+    yield work_queue
+    work_queue.close()
+
+
+def test_account_unit_queues_folder_units(work_queue):
+    work_queue.add_accounts(["me@proton.me"])
+    
+    unit = work_queue.claim("a", 60)
+    assert (unit['kind'], unit['account'], unit['attempt']) == ('account', "me@proton.me", 1)
+    work_queue.add_folders("me@proton.me", FOLDERS)
+    assert work_queue.complete(unit['id'], "a")
+    
+    folder = work_queue.claim("a", 60)
+    assert folder['kind'] == 'folder'
+    assert folder['payload']['name'] == 'Inbox'
+    assert (folder['payload']['position'], folder['payload']['count']) == (0, 2)
+    assert not work_queue.drained()
+
+
+def test_leased_unit_is_not_claimed_twice(work_queue):
+    work_queue.add_accounts(["me@proton.me"])
+    
+    assert work_queue.claim("a", 60) is not None
+    assert work_queue.claim("b", 60) is None
+
+
+def test_expired_lease_passes_to_another_worker(work_queue):
+    work_queue.add_accounts(["me@proton.me"])
+    first = work_queue.claim("a", 0.01)
+    time.sleep(0.05)
+    
+    second = work_queue.claim("b", 60)
+    
+    assert second['id'] == first['id']
+    assert second['attempt'] == 2
+    assert not work_queue.heartbeat(first['id'], "a", 60)
+    # The old holder can no longer complete the unit
+    assert not work_queue.complete(first['id'], "a")
+    assert work_queue.status()['units']['account'] == {'leased': 1}
+    assert work_queue.complete(second['id'], "b")
+    assert work_queue.drained()
+
+
+def test_failed_unit_is_parked_after_max_attempts(work_queue):
+    work_queue.add_accounts(["me@proton.me"])
+    
+    for _ in range(2):
+        unit = work_queue.claim("a", 60)
+        work_queue.fail(unit['id'], "a", RuntimeError("login failed"))
+    
+    assert work_queue.claim("a", 60) is None
+    status = work_queue.status()
+    assert status['failed'][0]['error'] == "login failed"
+    assert work_queue.drained()
+
+
+def test_leave_hands_units_back(work_queue):
+    work_queue.add_accounts(["me@proton.me"])
+    unit = work_queue.claim("a", 60)
+    
+    work_queue.leave("a")
+    
+    again = work_queue.claim("b", 60)
+    assert again['id'] == unit['id']
+    assert again['attempt'] == 1
+
+
+def test_claim_prefers_folders_of_open_accounts(work_queue):
+    for email in ("one@proton.me", "two@proton.me"):
+        work_queue.add_folders(email, FOLDERS)
+    
+    unit = work_queue.claim("a", 60, prefer_accounts=["two@proton.me"])
+    assert unit['account'] == "two@proton.me"
+    
+    only = work_queue.claim("b", 60, accounts=["one@proton.me"])
+    assert only['account'] == "one@proton.me"
+
+
+def test_requeue_resets_finished_accounts(work_queue):
+    work_queue.add_accounts(["me@proton.me"])
+    unit = work_queue.claim("a", 60)
+    work_queue.add_folders("me@proton.me", FOLDERS)
+    work_queue.complete(unit['id'], "a")
+    
+    work_queue.add_accounts(["me@proton.me"], requeue=True)
+    
+    assert work_queue.status()['units'] == {'account': {'pending': 1}}
+
+
+def test_unit_that_keeps_losing_its_lease_is_parked(work_queue):
+    work_queue.add_accounts(["me@proton.me"])
+    for worker in ("a", "b"):
+        assert work_queue.claim(worker, 0.01) is not None
+        time.sleep(0.05)
+    
+    assert work_queue.claim("a", 60) is None
+    assert work_queue.status()['failed'][0]['error'] == "lease expired 2 times"
+
+
+def test_heartbeat_keeps_a_long_unit_leased(work_queue):
+    work_queue.add_accounts(["me@proton.me"])
+    unit = work_queue.claim("a", 0.3)
+    
+    with LeaseHeartbeat(work_queue, unit['id'], "a", 0.3) as heartbeat:
+        time.sleep(0.6)
+        assert work_queue.claim("b", 60) is None
+    
+    assert not heartbeat.lost
+    assert work_queue.complete(unit['id'], "a")
+
+
+def test_heartbeat_notices_a_lost_lease(work_queue):
+    work_queue.add_accounts(["me@proton.me"])
+    unit = work_queue.claim("a", 0.01)
+    time.sleep(0.05)
+    work_queue.claim("b", 60)
+    
+    with LeaseHeartbeat(work_queue, unit['id'], "a", 0.09) as heartbeat:
+        time.sleep(0.2)
+    
+    assert heartbeat.lost